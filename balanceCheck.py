@@ -0,0 +1,81 @@
+import random
+import sys
+from types import SimpleNamespace
+import numpy as np
+from balanceSim import *
+
+# Fights played through the combat engine and the balance simulator for every case, pass a different number on
+# the command line. The simulator plays 10 times as many since it is much faster
+FIGHTS = 5000
+# Cases compared, the unrolled weapons deal round damage which often leaves an enemy on exactly 0 health
+CASES = [("easy", "Orc", "Iron Sword", True, "first"), ("easy", "Orc", "Gambler's Blade", False, "first"),
+         ("easy", "Boss", "Hurricane", False, "weakest"), ("normal", "Orc", "Mystic Wand", True, "first"),
+         ("hard", "Orc", "Thunder Bow", True, "weakest"), ("hard", "Orc", "Phoenix Bow", False, "first")]
+# Number of standard errors the results may differ by before the check fails
+LIMIT = 4
+
+
+def engine_fight(setting, cave, weapon, roll, target, rng):
+    # Plays one fight through CombatEngine.resolve with enemies and a player holding only the stats it uses,
+    # spawned and sorted the way Cave.setup_cave and Combat do. Returns whether it was won, the turns and health left
+    enemies = []
+    for name in SPAWN_ORDER:
+        low, high = setting["caves setup"][cave][name]
+        stats = setting["enemies"][name]
+        for _ in range(rng.randint(low, high)):
+            enemies.append(SimpleNamespace(
+                health=float(stats["health"]), maxHealth=float(stats["maxHealth"]), damage=float(stats["damage"]),
+                critRate=float(stats["crit_rate"]), critDamage=float(stats["crit_damage"]),
+                DOTTurns=int(stats["DOTTurns"]), DOTDam=float(stats["DOTDam"]),
+                heal_amount=float(stats["heal_amount"]), chances=list(stats["chances"].values()),
+                coins=0, affected_dot=[]))
+    weapon = SimpleNamespace(**weapon)
+    if roll:
+        for attr in ['damage', 'critRate', 'critDamage', 'DOTDam', 'splashDam']:
+            setattr(weapon, attr, round(getattr(weapon, attr) * rng.uniform(0.75, 1.25), 2))
+    player = SimpleNamespace(health=float(setting["player"]["health"]), damage=weapon.damage, coins=0,
+                             affected_dot=[], weapon=weapon)
+    engine = CombatEngine(player, enemies, rng)
+    # Combat sorts the enemies by the height of their buttons after the turn order is made
+    engine.enemies = [enemies[i] for i in sorted(range(len(enemies)), key=lambda i: (-1) ** (i % 2) * ((i + 1) // 2))]
+    if target == "weakest":
+        result = engine.resolve(lambda engine: min(engine.enemies, key=lambda enemy: enemy.health))
+    else:
+        result = engine.resolve()
+    return result == "victory", engine.turns, player.health
+
+
+def main():
+    # Compares the win rate, turns and health left of the simulator with the combat engine,
+    # exits with an error if any of them are further apart than chance explains
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else FIGHTS
+    settings = load_settings()
+    weapons = {weapon["name"]: weapon for weapon in load_weapons()}
+    rng = random.Random(0)
+    failed = 0
+    print(f"{'difficulty':<12}{'cave':<6}{'weapon':<17}{'roll':<7}{'target':<9}{'':<8}"
+          f"{'win rate':>10}{'turns':>8}{'health left':>13}")
+    for difficulty, cave, name, roll, target in CASES:
+        fights = [engine_fight(settings[difficulty], cave, weapons[name], roll, target, rng) for _ in range(n)]
+        won, turns, health = (np.array(i, dtype=float) for i in zip(*fights))
+        sim = BalanceSim(settings[difficulty], list(weapons.values()), seed=0)
+        result = sim.fight(cave, weapons[name], n * 10, roll, target)
+        engine = {"win rate": won.mean(), "turns": turns[won == 1].mean(), "health left": health[won == 1].mean()}
+        # Standard errors of the differences, the spread of the simulator is taken to be the same as the engine's
+        errors = {"win rate": np.sqrt(result["win rate"] * (1 - result["win rate"]) * 1.1 / n),
+                  "turns": turns[won == 1].std() * np.sqrt(1.1 / max(won.sum(), 1)),
+                  "health left": health[won == 1].std() * np.sqrt(1.1 / max(won.sum(), 1))}
+        bad = [key for key in engine if abs(engine[key] - result[key]) > LIMIT * errors[key] + 1e-9]
+        failed += bool(bad)
+        for label, values in [("engine", engine), ("sim", result)]:
+            print(f"{difficulty:<12}{cave:<6}{name:<17}{str(roll):<7}{target:<9}{label:<8}"
+                  f"{values['win rate']:>10.1%}{values['turns']:>8.2f}{values['health left']:>13.1f}")
+        if bad:
+            print(f"{'':<59}mismatch in {', '.join(bad)}")
+    if failed:
+        sys.exit(f"{failed} of {len(CASES)} cases differ between the simulator and the combat engine")
+    print(f"All {len(CASES)} cases match")
+
+
+if __name__ == "__main__":
+    main()
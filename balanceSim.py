@@ -0,0 +1,282 @@
+import csv
+import json
+import sys
+import time
+from pathlib import Path
+import numpy as np
+from combatEngine import CombatEngine, WeaponType
+
+# Order Cave.populate creates the enemies in, which is also the order of their turns
+SPAWN_ORDER = ["Orc Leader", "Orc Soldier", "Orc Mage", "Orc Grunt", "Orc Villager"]
+ACTIONS = CombatEngine.actions
+HEAL = ACTIONS.index('heal')
+BUFF = ACTIONS.index('buff')
+
+
+def load_settings():
+    with open(Path(__file__).resolve().with_name("settings.json")) as file:
+        return json.load(file)
+
+
+def load_weapons():
+    # Reads the weapon rows from the csv files without loading their icons
+    weapons = []
+    for weapon_type in ["swords", "wands", "bows"]:
+        with open(Path(__file__).resolve().with_name(f"{weapon_type}.csv"), mode='r', newline='') as file:
+            reader = csv.reader(file)
+            next(reader)  # Skip the heading
+            for row in reader:
+                weapons.append({"name": row[0], "damage": float(row[1]), "critRate": float(row[2]),
+                                "critDamage": float(row[3]), "DOTTurns": int(row[4]), "DOTDam": float(row[5]),
+                                "splashRange": int(row[6]), "splashDam": float(row[7]), "rarity": int(row[8]),
+                                "weaponType": getattr(WeaponType, weapon_type.upper())})
+    return weapons
+
+
+class BalanceSim:
+    # Plays many fights of one difficulty at once with the rules of CombatEngine.
+    # Every fight is a row of NumPy arrays and every enemy which can spawn in the cave has a column, enemies
+    # which were not spawned or have died are columns with no health. Turns are played for all rows together
+    def __init__(self, setting, weapons, seed=None):
+        self.setting = setting
+        self.weapons = weapons
+        self.rng = np.random.default_rng(seed)
+        self.max_rounds = 200  # Fights still going after this many rounds are counted as losses
+
+    def slots(self, cave):
+        # Returns the enemy type of every column and the range of how many of each type spawn
+        setup = self.setting["caves setup"][cave]
+        slots = []
+        for name in SPAWN_ORDER:
+            slots += [(name, i, setup[name]) for i in range(setup[name][1])]
+        return slots
+
+    def enemy_stats(self, slots):
+        # Stats of every column as arrays, read the same way Enemy reads them
+        enemies = self.setting["enemies"]
+        stats = {}
+        for attr, key in [("maxHealth", "maxHealth"), ("damage", "damage"), ("critRate", "crit_rate"),
+                          ("critDamage", "crit_damage"), ("DOTDam", "DOTDam"), ("heal_amount", "heal_amount")]:
+            stats[attr] = np.array([float(enemies[name][key]) for name, _, _ in slots])
+        stats["health"] = np.array([float(enemies[name]["health"]) for name, _, _ in slots])
+        stats["DOTTurns"] = [int(enemies[name]["DOTTurns"]) for name, _, _ in slots]
+        stats["chances"] = np.array([list(enemies[name]["chances"].values()) for name, _, _ in slots])
+        # The action only changes where the roll passes a chance, so each enemy gets its chances in order and the
+        # action taken by a roll below each of them, which turns choosing an action into a binary search
+        stats["breaks"] = []
+        stats["outcomes"] = []
+        for chances in stats["chances"]:
+            breaks = np.unique(chances)
+            stats["breaks"].append(breaks)
+            stats["outcomes"].append(np.array([next((i for i, chance in enumerate(chances) if roll < chance), BUFF)
+                                               for roll in np.concatenate([[0.0], breaks])]))
+        return stats
+
+    def spawn(self, slots, n):
+        # Randomly decide which columns have an enemy in each fight, like setup_cave does with randint
+        present = np.zeros((n, len(slots)), dtype=bool)
+        counts = {}
+        for col, (name, i, (low, high)) in enumerate(slots):
+            if name not in counts:
+                counts[name] = self.rng.integers(low, high + 1, n)
+            present[:, col] = i < counts[name]
+        # Combat sorts the enemies by the height of their buttons, the nth enemy spawned is placed
+        # (n + 1) // 2 buttons above the first one when n is odd and below it when n is even
+        spawned = np.cumsum(present, axis=1) - 1
+        order = np.where(spawned % 2, -((spawned + 1) // 2), (spawned + 1) // 2)
+        return present, np.where(present, order, len(slots))
+
+    def weapon_stats(self, weapon, n, roll):
+        # Stats of the weapon in every fight, bought and found weapons have their stats rolled like Weapon.roll
+        stats = {attr: np.full(n, float(weapon[attr]))
+                 for attr in ['damage', 'critRate', 'critDamage', 'DOTDam', 'splashDam']}
+        if roll:
+            for attr in stats:
+                stats[attr] = np.round(stats[attr] * self.rng.uniform(0.75, 1.25, n), 2)
+        return stats
+
+    def pick(self, candidates):
+        # Picks one column at random out of the candidates of each row
+        counts = candidates.sum(axis=1)
+        k = (self.rng.random(len(counts)) * counts).astype(int)
+        return np.argmax(np.cumsum(candidates, axis=1) > k[:, None], axis=1)
+
+    def fight(self, cave, weapon, n, roll=True, target="first"):
+        # Plays n fights of the player with the weapon against the cave.
+        # target is "first" to always attack the top enemy like CombatEngine.resolve or "weakest" for the enemy
+        # with the least health. Returns the win rate and the mean turns and health remaining of the won fights
+        slots = self.slots(cave)
+        enemy = self.enemy_stats(slots)
+        width = len(slots)
+        present, order = self.spawn(slots, n)
+        health = np.where(present, enemy["health"], 0.0)
+        damage = np.tile(enemy["damage"], (n, 1))
+        player_health = np.full(n, float(self.setting["player"]["health"]))
+        gun = self.weapon_stats(weapon, n, roll)
+        # Damage over time still to come, index 0 is dealt on the next turn of the player or enemy
+        length = max([weapon["DOTTurns"], 1] + enemy["DOTTurns"])
+        dot = np.zeros((n, width, length))
+        player_dot = np.zeros((n, length))
+        turns = np.zeros(n, dtype=int)
+        done = np.zeros(n, dtype=bool)
+        won = np.zeros(n, dtype=bool)
+        skip = np.zeros(n, dtype=bool)
+        stale = np.full(n, -1)  # Enemy attacked to exactly 0 health whose turn was next, -1 for none
+        live = np.arange(n)  # Fights which are not over yet
+
+        def tick(queue, idx):
+            # Deals the damage over time due this turn and moves the rest forward
+            due = queue[idx, ..., 0].copy()
+            queue[idx, ..., :-1] = queue[idx, ..., 1:]
+            queue[idx, ..., -1] = 0
+            return due
+
+        def finish(idx):
+            # Same checks as the start of CombatEngine.step for the fights which just had a turn,
+            # the player dying is checked first
+            lost = player_health[idx] <= 0
+            cleared = ~lost & ~(health[idx] > 0).any(axis=1)
+            done[idx[lost | cleared]] = True
+            won[idx[cleared]] = True
+
+        # Turn order of the columns, -1 is the player who goes last with a sword
+        queue = list(range(width))
+        queue = queue + [-1] if weapon["weaponType"] == WeaponType.SWORDS else [-1] + queue
+        # Damage over time only has to be ticked if anything deals it
+        player_dots = any(enemy["DOTTurns"])
+        enemy_dots = weapon["DOTTurns"] > 0
+        finish(live)
+        for _ in range(self.max_rounds):
+            live = live[~done[live]]
+            if not len(live):
+                break
+            for col in queue:
+                if col == -1:
+                    idx = live[~done[live]]
+                    if player_dots:
+                        player_health[idx] -= tick(player_dot, idx)
+                    acted = idx[player_health[idx] > 0]
+                    # The engine keeps the enemy whose turn is next even if the attack kills it, then the enemy
+                    # after it loses its turn. The killed enemy still acts if it was left on exactly 0 health
+                    following = (health[acted] > 0).argmax(axis=1)
+                    self.player_attack(acted, health, dot, order, gun, weapon, target)
+                    skip[acted] = health[acted, following] <= 0
+                    stale[acted] = np.where(health[acted, following] == 0, following, -1)
+                    turns[acted] += 1
+                else:
+                    idx = live[~done[live] & (health[live, col] > 0)]
+                    skipping = skip[idx]
+                    acted = idx
+                    # Turns are only lost after an attack killed the enemy whose turn was next, which is rare
+                    if skipping.any():
+                        skipped = idx[skipping]
+                        skip[skipped] = False
+                        stalled = skipped[stale[skipped] >= 0]
+                        for dead in np.unique(stale[stalled]):
+                            self.stale_action(stalled[stale[stalled] == dead], dead, enemy, health, damage,
+                                              player_health, player_dot, dot, turns, tick if enemy_dots else None)
+                        stale[skipped] = -1
+                        acted = idx[~skipping]
+                    if enemy_dots:
+                        health[acted, col] -= tick(dot[:, col], acted)
+                    acted = acted[health[acted, col] >= 0]
+                    self.enemy_action(acted, col, enemy, health, damage, player_health, player_dot)
+                    turns[acted] += 1
+                    # An enemy's turn can only end a fight by killing the player or the enemy itself
+                    idx = idx[(player_health[idx] <= 0) | (health[idx, col] <= 0)]
+                finish(idx)
+        return {"win rate": won.mean(), "turns": turns[won].mean() if won.any() else float("nan"),
+                "health left": player_health[won].mean() if won.any() else float("nan")}
+
+    def player_attack(self, idx, health, dot, order, gun, weapon, target):
+        alive = health[idx] > 0
+        rank = np.where(alive, order[idx], len(order[0]))
+        if target == "weakest":
+            chosen = np.where(alive, health[idx], np.inf).argmin(axis=1)
+        else:
+            chosen = rank.argmin(axis=1)
+        crit = self.rng.random(len(idx)) < gun["critRate"][idx]
+        damage = gun["damage"][idx]
+        damage_dealt = np.where(crit, damage * gun["critDamage"][idx], damage)
+        health[idx, chosen] -= damage_dealt
+        turns = weapon["DOTTurns"]
+        if turns:
+            dot[idx, chosen, :turns] += (damage * gun["DOTDam"][idx])[:, None]
+        if not weapon["splashRange"]:
+            return
+        # Splash damage to the enemies within the splash range of the target in the sorted list, which are the
+        # enemies sorted between the ones splash range places before and after the target
+        rows = np.arange(len(idx))
+        ranked = np.sort(rank, axis=1)
+        position = (rank < rank[rows, chosen][:, None]).sum(axis=1)
+        last = alive.sum(axis=1) - 1
+        low = ranked[rows, np.maximum(position - weapon["splashRange"], 0)]
+        high = ranked[rows, np.minimum(position + weapon["splashRange"], last)]
+        splashed = alive & (rank >= low[:, None]) & (rank <= high[:, None])
+        splashed[rows, chosen] = False
+        splash_damage = damage_dealt * gun["splashDam"][idx]
+        health[idx] -= splashed * splash_damage[:, None]
+        if turns:
+            hit, col = np.nonzero(splashed)
+            dot[idx[hit], col, :turns] += (splash_damage * gun["DOTDam"][idx])[hit, None]
+
+    def stale_action(self, idx, col, enemy, health, damage, player_health, player_dot, dot, turns, tick):
+        # The enemy in col was attacked to exactly 0 health just before its turn, it has left the fight but its
+        # damage over time still ticks and it acts if that leaves it on 0 health
+        if tick:
+            idx = idx[tick(dot[:, col], idx) <= 0]
+        self.enemy_action(idx, col, enemy, health, damage, player_health, player_dot, in_fight=False)
+        turns[idx] += 1
+
+    def enemy_action(self, idx, col, enemy, health, damage, player_health, player_dot, in_fight=True):
+        # Each chance is compared to the same roll and the first one above it is the action, buff otherwise
+        roll = self.rng.random(len(idx))
+        action = enemy["outcomes"][col][np.searchsorted(enemy["breaks"][col], roll, side="right")]
+        # Sword, bow and wand attacks
+        hit = action < HEAL
+        attacked = idx[hit]
+        attacker = damage[attacked, col]
+        crit = self.rng.random(len(attacker)) < enemy["critRate"][col]
+        player_health[attacked] -= np.where(crit, attacker * enemy["critDamage"][col], attacker)
+        turns = enemy["DOTTurns"][col]
+        if turns:
+            player_dot[attacked, :turns] += (attacker * enemy["DOTDam"][col])[:, None]
+        # Heal and buff pick a random enemy still in the fight, including this one if it has no health left
+        # but is still in the fight
+        support = ~hit
+        idx, action = idx[support], action[support]
+        candidates = health[idx] > 0
+        candidates[:, col] |= in_fight
+        chosen = self.pick(candidates)
+        heal = action == HEAL
+        healed = idx[heal], chosen[heal]
+        # Heals are applied with max like the game does, so the enemy is always back to at least full health
+        health[healed] = np.maximum(health[healed] + enemy["heal_amount"][col], enemy["maxHealth"][chosen[heal]])
+        buff = ~heal
+        damage[idx[buff], chosen[buff]] *= 1.2
+
+
+def main():
+    # Prints the results of every weapon against every cave of every difficulty,
+    # pass the number of fights per weapon and cave on the command line
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    settings = load_settings()
+    weapons = load_weapons()
+    fights = 0
+    start_time = time.perf_counter()
+    for difficulty, setting in settings.items():
+        sim = BalanceSim(setting, weapons, seed=0)
+        print(f"{difficulty:<8}{'weapon':<20}{'cave':<6}{'win rate':>10}{'turns':>8}{'health left':>13}")
+        for weapon in weapons:
+            for cave in setting["caves setup"]:
+                result = sim.fight(cave, weapon, n)
+                fights += n
+                print(f"{'':<8}{weapon['name']:<20}{cave:<6}{result['win rate']:>10.1%}{result['turns']:>8.1f}"
+                      f"{result['health left']:>13.1f}")
+        print()
+    elapsed = time.perf_counter() - start_time
+    print(f"{fights} fights in {elapsed:.2f}s, {fights / elapsed:.0f} fights per second")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import random
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pygame
+from mazeAlgorithms import *
+from mazeGen import Maze, MazeLayer, MazeNodeType, add_dead_ends, find_dead_ends, is_tree
+from utils import Fonts, Weapon, WeaponLoader, streams
+
+# Sizes of the mazes to compare the algorithms at, pass a maximum width on the command line to skip larger ones
+SIZES = [(25, 15), (100, 100), (500, 500), (1000, 1000), (2000, 2000)]
+# Sizes of the mazes to add dead ends to, a tenth of the rooms are turned into dead ends
+REPAIR_SIZES = [(25, 15), (101, 101), (201, 201)]
+# Maze sizes and cell sizes to compare full redraws of the maze layer at
+RENDER_SIZES = [(25, 15, 32), (500, 500, 4)]
+# Rarities the game picks weapons from
+LOOT_RARITIES = [[1, 2], [2, 3], [1, 2, 3]]
+
+
+def measure(algorithm, width, height):
+    # Returns the generation time, the fraction of rooms which are dead ends and the peak memory of the algorithm
+    random.seed(0)
+    start_time = time.perf_counter()
+    grid = algorithm.carve(width, height, (0, 0))
+    elapsed = time.perf_counter() - start_time
+    open_cells = grid != WALL
+    dead_ends = np.count_nonzero(open_cells & (count_neighbours(open_cells) == 1))
+    _, _, cols, rows = algorithm.lattice(width, height, (0, 0))
+    # Run again with allocations traced, tracing slows it down too much to time it in the same run
+    random.seed(0)
+    tracemalloc.start()
+    algorithm.carve(width, height, (0, 0))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, dead_ends / (cols * rows), peak
+
+
+def measure_repairs(algorithm, width, height):
+    # Returns the time taken to add dead ends to a tenth of the rooms, the passages moved and whether the maze is
+    # still a tree with nothing but rooms and passages open
+    random.seed(0)
+    grid = algorithm.carve(width, height, (0, 0))
+    grid[0, 0] = MazeNodeType.START.value
+    _, _, cols, rows = algorithm.lattice(width, height, (0, 0))
+    needed = np.count_nonzero(find_dead_ends(grid)) + cols * rows // 10
+    start_time = time.perf_counter()
+    moved = add_dead_ends(grid, (0, 0), needed, random.Random(0))
+    elapsed = time.perf_counter() - start_time
+    valid = is_tree(grid, (0, 0)) and not (grid[1::2, 1::2] != WALL).any()
+    return elapsed, moved, valid
+
+
+def measure_streaming(width, height):
+    # Peak memory of Eller's algorithm when the rows are consumed one at a time instead of stored
+    random.seed(0)
+    tracemalloc.start()
+    for _ in Eller().rows(width, height, (0, 0)):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def measure_rendering(width, height, cell_size, repeats=5):
+    # Returns the time of a full redraw with a rect per cell and with the palette image
+    random.seed(0)
+    maze = Maze(DepthFirst().carve(width, height, (0, 0)))
+    maze.visible[:] = True
+    layer = MazeLayer(maze, cell_size)
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        for y in range(height):
+            for x in range(width):
+                layer.draw_cell(x, y)
+    rects = (time.perf_counter() - start_time) / repeats
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        layer.redraw()
+    return rects, (time.perf_counter() - start_time) / repeats
+
+
+def linear_random(weapons, rarities):
+    # The walk along the weapons get_random used before it had tables, to compare against
+    total_rarity = sum(weapon.rarity for weapon in weapons if weapon.rarity in rarities)
+    pick = streams.loot.randint(1, total_rarity)
+    current = 0
+    for weapon in weapons:
+        if weapon.rarity not in rarities:
+            continue
+        current += weapon.rarity
+        if current >= pick:
+            return weapon
+
+
+def measure_loot(loader, rarities, n=200000):
+    # Returns the time per weapon of the linear walk and of get_randoms, whether both pick the same weapons from the
+    # same seed and the chi-squared statistic of the picks against the rarity weights with its 99.9% critical value
+    streams.reseed(0)
+    start_time = time.perf_counter()
+    linear = [linear_random(loader.weapons, rarities) for _ in range(n)]
+    linear_time = (time.perf_counter() - start_time) / n
+    streams.reseed(0)
+    start_time = time.perf_counter()
+    picks = loader.get_randoms(rarities, n)
+    batch_time = (time.perf_counter() - start_time) / n
+    weapons, totals = loader.table(rarities)
+    counts = {id(weapon): 0 for weapon in weapons}
+    for weapon in picks:
+        counts[id(weapon)] += 1
+    chi_squared = sum((counts[id(weapon)] - n * weapon.rarity / totals[-1]) ** 2 / (n * weapon.rarity / totals[-1])
+                      for weapon in weapons)
+    # Wilson-Hilferty approximation of the chi-squared distribution, 3.09 is the 99.9% point of the normal distribution
+    df = len(weapons) - 1
+    critical = df * (1 - 2 / (9 * df) + 3.09 * (2 / (9 * df)) ** 0.5) ** 3
+    same = all(a is b for a, b in zip(linear, picks))
+    return linear_time, batch_time, same, chi_squared, critical
+
+
+def measure_text(loader, n=500):
+    # Renders the stats of n rolled weapons like the inventory and shop do, returns the time per weapon and the
+    # counters of the font registry and text cache over them
+    streams.reseed(0)
+    before = Fonts.stats()
+    start_time = time.perf_counter()
+    for archetype in loader.get_randoms([1, 2, 3], n):
+        weapon = Weapon(archetype)
+        weapon.roll()
+        weapon.stats_surface
+    elapsed = (time.perf_counter() - start_time) / n
+    after = Fonts.stats()
+    return elapsed, {key: after[key] - before[key] if "cached" not in key else after[key] for key in after}
+
+
+def main():
+    max_width = int(sys.argv[1]) if len(sys.argv) > 1 else max(width for width, _ in SIZES)
+    print(f"{'algorithm':<10}{'size':>12}{'time (s)':>12}{'dead ends':>12}{'memory (MB)':>14}")
+    for width, height in SIZES:
+        if width > max_width:
+            continue
+        for name, algorithm in ALGORITHMS.items():
+            elapsed, dead_ends, peak = measure(algorithm(), width, height)
+            print(f"{name:<10}{f'{width}x{height}':>12}{elapsed:>12.3f}{dead_ends:>12.1%}{peak / 2 ** 20:>14.2f}")
+        peak = measure_streaming(width, height)
+        print(f"{'eller rows':<10}{f'{width}x{height}':>12}{'':>12}{'':>12}{peak / 2 ** 20:>14.2f}")
+    print()
+    print(f"{'repairs':<10}{'size':>12}{'time (s)':>12}{'moved':>12}{'tree':>6}")
+    broken = []
+    for width, height in REPAIR_SIZES:
+        if width > max_width:
+            continue
+        for name, algorithm in ALGORITHMS.items():
+            elapsed, moved, valid = measure_repairs(algorithm(), width, height)
+            print(f"{name:<10}{f'{width}x{height}':>12}{elapsed:>12.3f}{moved:>12}{str(valid):>6}")
+            if not valid:
+                broken.append(f"{name} {width}x{height}")
+    # Moving passages has to leave every maze connected and free of loops
+    if broken:
+        sys.exit(f"Adding dead ends broke the mazes of {', '.join(broken)}")
+    print()
+    print(f"{'redraw':<10}{'size':>12}{'cell':>6}{'rects (s)':>12}{'palette (s)':>13}")
+    for width, height, cell_size in RENDER_SIZES:
+        rects, palette = measure_rendering(width, height, cell_size)
+        print(f"{'maze':<10}{f'{width}x{height}':>12}{cell_size:>6}{rects:>12.4f}{palette:>13.4f}")
+    print()
+    # The weapons render their stats and their icons need a display to be converted
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    loader = WeaponLoader()
+    print(f"{'loot':<10}{'rarities':>12}{'linear (us)':>13}{'table (us)':>12}{'same':>6}{'chi2':>9}{'limit':>8}")
+    failed = []
+    for rarities in LOOT_RARITIES:
+        linear, batch, same, chi_squared, critical = measure_loot(loader, rarities)
+        print(f"{'weapons':<10}{str(rarities):>12}{linear * 1e6:>13.2f}{batch * 1e6:>12.2f}{str(same):>6}"
+              f"{chi_squared:>9.1f}{critical:>8.1f}")
+        if not same or chi_squared > critical:
+            failed.append(rarities)
+    print()
+    elapsed, stats = measure_text(loader)
+    print(f"{'text':<10}{'weapon (us)':>12}" + "".join(f"{key:>14}" for key in stats))
+    print(f"{'stats':<10}{elapsed * 1e6:>12.1f}" + "".join(f"{value:>14}" for value in stats.values()))
+    # The loot tables have to pick the same weapons as the linear walk, with the chances the rarities give them
+    if failed:
+        sys.exit(f"The loot tables of rarities {', '.join(map(str, failed))} do not match the rarity weights")
+
+
+if __name__ == "__main__":
+    main()
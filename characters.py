@@ -2,30 +2,68 @@ from PIL import Image
 from utils import *
 
 
+class EnemyPrototype:
+    # Stats of an enemy type converted from the strings in the settings once, read by name so the order of the
+    # settings does not matter
+    def __init__(self, setting):
+        self.name = setting["name"]
+        self.health = float(setting["health"])
+        self.maxHealth = float(setting["maxHealth"])
+        self.damage = float(setting["damage"])
+        self.critRate = float(setting["crit_rate"])
+        self.critDamage = float(setting["crit_damage"])
+        self.DOTTurns = int(setting["DOTTurns"])
+        self.DOTDam = float(setting["DOTDam"])
+        self.heal_amount = float(setting["heal_amount"])
+        self.coins = int(setting["coins"])
+        self.chances = tuple(setting["chances"].values())
+        self.SpriteSheet = Path(__file__).resolve().parent / setting["SpriteSheet"]
+
+
 class EnemyLoader:
+    # Enemies which have been released, keyed by name and shared by every loader so long sessions reuse them
+    pool = {}
+
     def __init__(self, setting, game):
         self.game = game
-        # Load the enemy settings from the provided settings
-        self.setting = {}
-        for k, v in setting.items():
-            v["chances"] = list(v["chances"].values())
-            self.setting[k] = v
+        # Compile the enemy settings into prototypes
+        self.prototypes = {k: EnemyPrototype(v) for k, v in setting.items()}
 
     def get_enemy(self, type):
-        # return a new instance of enemy
-        return Enemy(*self.setting[type].values(), self.game)
+        # return an enemy reset to the prototype, reusing a released one if there is one
+        prototype = self.prototypes[type]
+        free = EnemyLoader.pool.get(prototype.name)
+        if free:
+            enemy = free.pop()
+            enemy.reset(prototype, self.game)
+            return enemy
+        return Enemy(prototype, self.game)
+
+    @staticmethod
+    def release(enemies):
+        # Return enemies which are no longer in a fight to the pool
+        for enemy in enemies:
+            EnemyLoader.pool.setdefault(enemy.name, []).append(enemy)
 
 
 class SpriteLoader:
+    # Frames of every sprite sheet loaded so far keyed by its path and whether they are doubled in size,
+    # each sheet is only divided once and the frames are shared by all loaders using it
+    sheets = {}
+
     def __init__(self, player, sprite_sheet):
         self.player = player
         self.sprite_sheet = Path(__file__).resolve().parent / sprite_sheet
-        self.sprites = self.divide_sprite_sheet()
+        self.sprites = self.load_sheet(self.sprite_sheet)
+        self.reset()
+
+    def reset(self):
+        # Back to the first frame with no animation playing
         self.current_sprite = self.sprites[0][0]
         self.current_sprite_arr = [(0, 0)]
         self.sprite_idx = 0
-        self.next_sprite_cooldown = 12
-        self.frames_till_next = self.next_sprite_cooldown
+        self.next_sprite_cooldown = 13 / 60  # Seconds each frame is shown, the speed animations had at 60 fps
+        self.time_till_next = self.next_sprite_cooldown
         self.loop = True
         self.last_operation = None
         self.animationEnd = None
@@ -158,10 +196,16 @@ class SpriteLoader:
         self.update()
         self.last_operation = (self.dead, direction)
 
-    def next(self):
-        # Update the current sprite index based on the cooldown
-        if self.frames_till_next == 0:
-            self.frames_till_next = self.next_sprite_cooldown
+    def idle_time(self):
+        # Seconds which can pass before a looping animation shows another frame
+        return self.time_till_next if self.loop else 0
+
+    def next(self, dt):
+        # Update the current sprite index once the cooldown has passed, dt is the time passed in seconds.
+        # The time left over is carried to the next frame so the speed does not depend on the time step
+        self.time_till_next -= dt
+        if self.time_till_next <= 1e-9:
+            self.time_till_next = max(self.time_till_next + self.next_sprite_cooldown, 0)
             self.sprite_idx += 1
             if self.loop:
                 # Loop the animation if the loop flag is set
@@ -174,8 +218,6 @@ class SpriteLoader:
                         self.animationEnd(*self.params)
                     else:
                         self.animationEnd()
-        else:
-            self.frames_till_next -= 1
         self.update()
 
     def update(self):
@@ -183,13 +225,29 @@ class SpriteLoader:
         y, x = self.current_sprite_arr[self.sprite_idx]
         self.current_sprite = self.sprites[y][x]
 
-    def get_sprite(self):
-        # Convert the current sprite to a pygame image
-        return pygame.image.frombytes(self.current_sprite.tobytes(), self.current_sprite.size, "RGBA")
-
-    def divide_sprite_sheet(self, segment_width=32, segment_height=32):
+    def get_sprite(self, double=False):
+        # Returns the current frame, frames are converted once when the sheet is loaded so nothing is allocated here.
+        # Double returns the frame scaled with scale2x, which is also only done once per frame
+        if not double:
+            return self.current_sprite
+        y, x = self.current_sprite_arr[self.sprite_idx]
+        return self.load_sheet(self.sprite_sheet, True)[y][x]
+
+    @classmethod
+    def load_sheet(cls, sprite_sheet, double=False):
+        # Returns the frames of the sprite sheet, dividing it on first use
+        if (sprite_sheet, double) not in cls.sheets:
+            if double:
+                frames = [[pygame.transform.scale2x(frame) for frame in row] for row in cls.load_sheet(sprite_sheet)]
+            else:
+                frames = cls.divide_sprite_sheet(sprite_sheet)
+            cls.sheets[(sprite_sheet, double)] = frames
+        return cls.sheets[(sprite_sheet, double)]
+
+    @staticmethod
+    def divide_sprite_sheet(sprite_sheet, segment_width=32, segment_height=32):
         # Open the spritesheet image
-        spritesheet = Image.open(self.sprite_sheet)
+        spritesheet = Image.open(sprite_sheet)
         spritesheet_width, spritesheet_height = spritesheet.size
         # Calculate the number of segments horizontally and vertically
         num_segments_x = spritesheet_width // segment_width
@@ -205,113 +263,91 @@ class SpriteLoader:
                 right = left + segment_width
                 lower = upper + segment_height
                 segment = spritesheet.crop((left, upper, right, lower))
+                segment = pygame.image.frombytes(segment.tobytes(), segment.size, "RGBA")
+                # Convert to the display format for faster blits, only possible once a display exists
+                if pygame.display.get_surface() is not None:
+                    segment = segment.convert_alpha()
                 row.append(segment)
             segments.append(row)
         return segments
 
 
 class Enemy:
-    def __init__(self, name, health, maxHealth, damage, crit_rate, crit_damage, DOTTurns, DOTDam, heal_amount, coins,
-                 chances, SpriteSheet, game, size=(32, 32)):
-        self.name = name
-        self.health = float(health)
-        self.maxHealth = float(maxHealth)
-        self.damage = float(damage)
-        self.critRate = float(crit_rate)
-        self.critDamage = float(crit_damage)
-        self.DOTTurns = int(DOTTurns)
-        self.DOTDam = float(DOTDam)
-        self.heal_amount = float(heal_amount)
-        self.coins = int(coins)
+    def __init__(self, prototype, game, size=(32, 32)):
+        self.w, self.h = size
+        self.SpriteSheet = None
+        self.HealthBar = None
+        self.reset(prototype, game)
+
+    def reset(self, prototype, game):
+        # Set every stat from the prototype, pooled enemies are reset when they are handed out again
+        self.name = prototype.name
+        self.stats_changed = True  # Whether the health bar and stats surface need to be built again
+        self._health = prototype.health
+        self.maxHealth = prototype.maxHealth
+        self._damage = prototype.damage
+        self.critRate = prototype.critRate
+        self.critDamage = prototype.critDamage
+        self.DOTTurns = prototype.DOTTurns
+        self.DOTDam = prototype.DOTDam
+        self.heal_amount = prototype.heal_amount
+        self.coins = prototype.coins
         self.game = game
         self.facing = Direction.LEFT
-        self.SpriteSheet = SpriteLoader(self, SpriteSheet)
+        if self.SpriteSheet is None or self.SpriteSheet.sprite_sheet != prototype.SpriteSheet:
+            self.SpriteSheet = SpriteLoader(self, prototype.SpriteSheet)
+        else:
+            self.SpriteSheet.reset()
         self.SpriteSheet.idle(Direction.LEFT)
-        self.game = game
-        self.w, self.h = size
         self.affected_dot = []
-        self.chances = chances
+        self.chances = prototype.chances
         self.button = None
-        self.HealthBar = None
         self.stats_surface = None
-        self.update_stats()
         self.update_health_bar()
 
+    @property
+    def health(self):
+        return self._health
+
+    @health.setter
+    def health(self, health):
+        if health != self._health:
+            self._health = health
+            self.invalidate()
+
+    @property
+    def damage(self):
+        return self._damage
+
+    @damage.setter
+    def damage(self, damage):
+        if damage != self._damage:
+            self._damage = damage
+            self.invalidate()
+
+    def invalidate(self):
+        # Mark the displayed stats as changed, health and damage do this when set, other stats have to call it
+        self.stats_changed = True
+
     def update_health_bar(self):
+        # Only build the health bar and stats again if a displayed stat changed since they were last built
+        if not self.stats_changed:
+            return
+        self.stats_changed = False
         self.update_stats()
-        # Create a health bar based on the current health
-        self.HealthBar = pygame.Surface((self.w, 4))
+        # Draw the health bar based on the current health, the surface is created once and drawn over
+        if self.HealthBar is None:
+            self.HealthBar = pygame.Surface((self.w, 4))
+        self.HealthBar.fill((0, 0, 0))
         health_rect = pygame.Rect(0, 0, int(self.health * self.w / self.maxHealth), 4)
         pygame.draw.rect(self.HealthBar, (255, 0, 0), health_rect)
 
-    def combat_turn(self, player, combat):
-        # Update the turn index
-        combat.turnIdx += 1
-        combat.turnIdx %= len(combat.turnQueue)
-        combat.turn = combat.turnQueue[combat.turnIdx]
-        # Apply the damage over time effects
-        self.affected_dot = [i for i in self.affected_dot if i[1]]
-        for i in self.affected_dot:
-            self.health -= i[0]
-            combat.add_damage_display(*self.button.rect.center, i[0], True)
-            i[1] -= 1
-            self.update_health_bar()
-        if self.health >= 0:
-            # Randomly choose an action based on the chances
-            _ = random.random()
-            action = next((action for action, chance in zip(['sword', 'bow', 'wand', 'heal', 'buff'], self.chances) if
-                           _ < chance), 'buff')
-            getattr(self, action)(player, combat)
-        else:
-            combat.next()
-
-    def sword(self, player, combat):
-        self.SpriteSheet.sword(combat.next)
-        self.damage_player(player, combat)
-
-    def bow(self, player, combat):
-        self.SpriteSheet.bow(combat.next)
-        self.damage_player(player, combat)
-
-    def wand(self, player, combat):
-        self.SpriteSheet.wand(combat.next)
-        self.damage_player(player, combat)
-
-    def heal(self, _, combat):
-        target = random.choice(combat.enemies)
-        target.health += self.heal_amount
-        target.health = max(target.health, target.maxHealth)
-        self.SpriteSheet.wand(combat.next)
-
-    def buff(self, _, combat):
-        target = random.choice(combat.enemies)
-        target.damage *= 1.2
-        target.update_stats()
-        combat.game.alert.add_text(f"{self.name} buffed {target.name}", 1)
-        self.SpriteSheet.wand(combat.next)
-
-    def damage_player(self, player, combat):
-        # Deal damage to the player based on the crit rate
-        if random.random() < self.critRate:
-            player.health -= self.damage * self.critDamage
-            combat.add_damage_display(combat.game.offX * combat.game.cell_size + 100,
-                                      combat.game.offY * combat.game.cell_size - 16 + (
-                                              combat.game.screen.get_height() - combat.game.offY * combat.game.cell_size) // 2,
-                                      self.damage * self.critDamage, False)
-        else:
-            player.health -= self.damage
-            combat.add_damage_display(combat.game.offX * combat.game.cell_size + 100,
-                                      combat.game.offY * combat.game.cell_size - 16 + (
-                                              combat.game.screen.get_height() - combat.game.offY * combat.game.cell_size) // 2,
-                                      self.damage, False)
-        # Apply the damage over time effect
-        player.affected_dot.append([self.damage * self.DOTDam, self.DOTTurns])
-
     def display_stats(self, button):
         # display weapon stats when mouse hovers over weapon
         surface = button.info.stats_surface
         x, y = pygame.mouse.get_pos()
-        self.game.screen.blit(surface, (min(self.game.screen.get_width() - surface.get_width(), x + 10), y))
+        self.game.compositor.mark(
+            self.game.screen.blit(surface, (min(self.game.screen.get_width() - surface.get_width(), x + 10), y)))
 
     def info(self):
         # Returns the stats of the enemy
@@ -334,7 +370,7 @@ class Enemy:
         width = 0
         # Calculate the size of the surface such that it can fit all the strings
         for string, font_size in self.info():
-            font = pygame.font.SysFont("Arial", font_size)
+            font = Fonts.get("Arial", font_size)
             total_height += font.get_linesize()
             width = max(width, font.size(string)[0])
         surface = pygame.Surface((width, total_height))
@@ -345,8 +381,8 @@ class Enemy:
         y_offset = text_y
         # Render the strings on the surface
         for string, font_size in self.info():
-            font = pygame.font.SysFont("Arial", font_size)
-            text_surface = font.render(string, True, text_color)
+            font = Fonts.get("Arial", font_size)
+            text_surface = Fonts.render(string, font, text_color)
             text_rect = text_surface.get_rect(x=text_x, y=y_offset)
             surface.blit(text_surface, text_rect)
             y_offset += font.get_linesize()
@@ -354,12 +390,15 @@ class Enemy:
 
 
 class Player:
+    # Stat icons loaded so far keyed by file name, the images are large so they are only loaded once
+    icons = {}
+
     def __init__(self, x, y, setting):
         # Initialize the player with the provided settings
         self.x = x
         self.y = y
         self.facing = Direction.DOWN
-        self.actioning = 5
+        self.actioning = 5 / 60  # Seconds left of the walk animation
         self.maxHealth = setting['maxHealth']
         self.health = setting['health']
         self.coins = setting['coins']
@@ -369,11 +408,18 @@ class Player:
         self.closest_boss = None
         self.closest_mouse = None
         self.sprite = SpriteLoader(self, "Characters/Warrior-Red.png")
-        self.healthIcon = pygame.image.load(Path(__file__).resolve().with_name("heart.png")).convert_alpha()
-        self.coinIcon = pygame.image.load(Path(__file__).resolve().with_name("coin.png")).convert_alpha()
-        self.damIcon = pygame.image.load(Path(__file__).resolve().with_name("attack.png")).convert_alpha()
+        self.healthIcon = self.load_icon("heart.png")
+        self.coinIcon = self.load_icon("coin.png")
+        self.damIcon = self.load_icon("attack.png")
         self.weaponButton = None
         self.weapon = None
         self.canMove = True
         self.inCombat = False
         self.affected_dot = []
+
+    @classmethod
+    def load_icon(cls, name):
+        # Returns the shared icon, icons are shared so they must not be drawn on
+        if name not in cls.icons:
+            cls.icons[name] = pygame.image.load(Path(__file__).resolve().with_name(name)).convert_alpha()
+        return cls.icons[name]
@@ -0,0 +1,149 @@
+import enum
+import random
+
+
+class WeaponType(enum.Enum):
+    SWORDS = 0
+    BOWS = 1
+    WANDS = 2
+
+
+class CombatEngine:
+    # Rules of a fight without any rendering, animations or timing.
+    # The player needs health, damage, coins, affected_dot and a weapon, enemies need the stats loaded from the
+    # settings. Every method returns a list of events describing what happened so the on screen combat can show them:
+    #   ("damage", target, amount, crit)  a hit from an attack or splash
+    #   ("dot", target, amount)           damage over time ticking at the start of a turn
+    #   ("killed", enemy)                 an enemy was removed from the fight
+    #   ("action", enemy, action, target) an enemy used "sword", "bow", "wand", "heal" or "buff"
+    #   ("victory",) or ("defeat",)       the fight is over
+    actions = ['sword', 'bow', 'wand', 'heal', 'buff']
+
+    def __init__(self, player, enemies, rng=random):
+        self.player = player
+        self.enemies = enemies
+        self.rng = rng
+        # Determine the turn order based on player's weapon type
+        if player.weapon.weaponType == WeaponType.SWORDS:
+            self.turnQueue = enemies + [player]
+        else:
+            self.turnQueue = [player] + enemies
+        self.turnIdx = 0
+        self.turn = self.turnQueue[0]
+        self.turns = 0  # Number of attacks and actions taken
+        self.result = None  # "victory" or "defeat" once the fight is over
+
+    def player_turn(self):
+        return self.turn is self.player
+
+    def advance_turn(self):
+        # Advance the turn index and ensure it wraps correctly around the turn queue
+        self.turnIdx += 1
+        self.turnIdx %= len(self.turnQueue)
+        self.turn = self.turnQueue[self.turnIdx]
+
+    def step(self):
+        # Play turns until the player has to choose a target or an enemy took an action
+        events = []
+        while True:
+            if self.player.health <= 0:
+                self.result = "defeat"
+                events.append(("defeat",))
+                return events
+            self.remove_dead(events)
+            if not self.enemies:
+                self.result = "victory"
+                events.append(("victory",))
+                return events
+            if self.player_turn():
+                # Player's turn starts with the damage over time effects
+                self.tick_dot(self.player, events)
+                if self.player.health <= 0:
+                    self.result = "defeat"
+                    events.append(("defeat",))
+                return events
+            enemy = self.turn
+            self.advance_turn()
+            self.tick_dot(enemy, events)
+            if enemy.health >= 0:
+                self.enemy_action(enemy, events)
+                return events
+            # The enemy died from damage over time, carry on with the next turn
+
+    def remove_dead(self, events):
+        # Remove defeated enemies from the fight and give their coins to the player
+        for i in self.enemies:
+            if i.health <= 0:
+                self.player.coins += i.coins
+                self.turnIdx -= self.turnQueue.index(i) < self.turnIdx
+                events.append(("killed", i))
+        self.enemies = [i for i in self.enemies if i.health > 0]
+        self.turnQueue = [i for i in self.turnQueue if i.health > 0]
+        self.turnIdx %= len(self.turnQueue)
+
+    @staticmethod
+    def tick_dot(target, events):
+        # Apply the damage over time effects which have turns left
+        target.affected_dot = [i for i in target.affected_dot if i[1]]
+        for i in target.affected_dot:
+            target.health -= i[0]
+            events.append(("dot", target, i[0]))
+            i[1] -= 1
+
+    def enemy_action(self, enemy, events):
+        # Randomly choose an action based on the chances, each chance is compared to the same roll
+        roll = self.rng.random()
+        action = next((action for action, chance in zip(self.actions, enemy.chances) if roll < chance), 'buff')
+        target = self.player
+        if action == 'heal':
+            target = self.rng.choice(self.enemies)
+            target.health += enemy.heal_amount
+            target.health = max(target.health, target.maxHealth)
+        elif action == 'buff':
+            target = self.rng.choice(self.enemies)
+            target.damage *= 1.2
+        else:
+            # Deal damage to the player based on the crit rate and apply the damage over time effect
+            damage = enemy.damage * enemy.critDamage if self.rng.random() < enemy.critRate else enemy.damage
+            self.player.health -= damage
+            events.append(("damage", self.player, damage, False))
+            self.player.affected_dot.append([enemy.damage * enemy.DOTDam, enemy.DOTTurns])
+        self.turns += 1
+        events.append(("action", enemy, action, target))
+
+    def player_attack(self, target):
+        # Attack the target with the player's weapon, only allowed on the player's turn
+        events = []
+        if not self.player_turn():
+            return events
+        self.advance_turn()
+        weapon = self.player.weapon
+        # Calculate damage and apply critical hit multiplier if applicable
+        crit = self.rng.random() < weapon.critRate
+        damage_dealt = self.player.damage * weapon.critDamage if crit else self.player.damage
+        target.health -= damage_dealt
+        events.append(("damage", target, damage_dealt, crit))
+        # Apply DOT effects if the weapon has any
+        target.affected_dot.append([self.player.damage * weapon.DOTDam, weapon.DOTTurns])
+        # Apply splash damage to enemies within the splash range of the target
+        target_idx = self.enemies.index(target)
+        splash_damage = damage_dealt * weapon.splashDam
+        for i in range(len(self.enemies)):
+            if self.enemies[i] is target or abs(i - target_idx) > weapon.splashRange:
+                continue
+            self.enemies[i].health -= splash_damage
+            events.append(("damage", self.enemies[i], splash_damage, False))
+            self.enemies[i].affected_dot.append([splash_damage * weapon.DOTDam, weapon.DOTTurns])
+        self.turns += 1
+        return events
+
+    def resolve(self, choose_target=None):
+        # Play the whole fight without waiting for animations and return the result.
+        # choose_target picks the enemy the player attacks from the engine, the first enemy by default
+        while True:
+            events = self.step()
+            if self.result:
+                return self.result
+            # Step again after an enemy action, the player's damage over time is dealt when their turn starts
+            if not events or events[-1][0] != "action":
+                self.player_attack(choose_target(self) if choose_target else self.enemies[0])
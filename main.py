@@ -1,91 +1,92 @@
 import math
 from mazeGen import *
 from characters import *
-import random
+from combatEngine import *
 import sys
 import time
-from collections import deque
 import numpy as np
 import pygame
-import copy
 import json
 
-sys.setrecursionlimit(10000)
-
 
 class Combat:
     def __init__(self, player, enemies, game, cave):
         # Initialize combat with player, enemies, game context, and the specific cave
-        self.enemies = enemies
+        # The rules of the fight are played by the combat engine, this class shows them and waits for animations
+        self.engine = CombatEngine(player, enemies, streams.combat)
         self.player = player
-        # Determine the turn order based on player's weapon type
-        if player.weapon.weaponType == WeaponType.SWORDS:
-            self.turnQueue = enemies + [player]
-        else:
-            self.turnQueue = [player] + enemies
-        self.turnIdx = 0
         # Set player sprite to idle and facing direction to right
         self.player.sprite.idle(Direction.RIGHT)
         self.player.facing = Direction.RIGHT
         self.game = game
         self.cave = cave
-        self.turn = self.turnQueue[0]
         self.damages = []
         self.setup()
         self.next()
 
+    @property
+    def enemies(self):
+        return self.engine.enemies
+
+    @property
+    def turn(self):
+        return self.engine.turn
+
     def next(self):
         # Logic to advance to the next turn in combat
-        # Check if the player has died
-        if self.player.health <= 0:
-            self.player.sprite.die(self.game.game_over, "You Died")
-            return
-        # Check if any enemy has been defeated
-        self.game.buttons["Combat"] = [i for i in self.game.buttons["Combat"] if
-                                       not isinstance(i.info, Enemy) or i.info.health > 0]
-        for i in self.enemies:
-            if i.health <= 0:
-                self.player.coins += i.coins
-                self.turnIdx -= self.turnQueue.index(i) < self.turnIdx
-        self.enemies = [i for i in self.enemies if i.health > 0]
-        self.turnQueue = [i for i in self.turnQueue if i.health > 0]
-        self.turnIdx %= len(self.turnQueue)
-        # Check if all enemies have been defeated
-        if not self.enemies:
-            if self.cave.cave_type == CaveType.BOSS:
-                self.game.game_over("You Have Beaten The Game!")
-            self.player.coins += self.cave.reward
-            self.cave.reward = 0
-            self.cave.cave_type = CaveType.BLANK
-            self.exit()
-        # Advance to the next turn
-        if self.turn != self.player:
-            self.turn.combat_turn(self.player, self)
-        else:
-            # Player's turn and update the player's health based on damage over time effects
-            self.player.affected_dot = [i for i in self.player.affected_dot if i[1]]
-            for i in self.player.affected_dot:
-                self.player.health -= i[0]
-                self.add_damage_display(self.game.offX * self.game.cell_size + 100,
-                                        self.game.offY * self.game.cell_size - 16 + (
-                                                self.game.screen.get_height() - self.game.offY * self.game.cell_size) // 2,
-                                        i[0], False)
-                i[1] -= 1
-            if self.player.health <= 0:
-                self.game.game_over("You Died")
+        self.show(self.engine.step())
+
+    def show(self, events):
+        # Show the events returned by the combat engine
+        for event in events:
+            if event[0] == "damage":
+                _, target, amount, crit = event
+                self.add_damage_display(*self.position(target), amount, crit)
+            elif event[0] == "dot":
+                _, target, amount = event
+                self.add_damage_display(*self.position(target), amount, target != self.player)
+            elif event[0] == "killed":
+                # Remove the button of the defeated enemy and return it to the pool
+                self.game.buttons["Combat"] = [i for i in self.game.buttons["Combat"] if i.info != event[1]]
+                EnemyLoader.release([event[1]])
+            elif event[0] == "action":
+                # Play the enemy's animation, the next turn starts once it ends
+                _, enemy, action, target = event
+                if action == "buff":
+                    self.game.alert.add_text(f"{enemy.name} buffed {target.name}", 1)
+                getattr(enemy.SpriteSheet, action if action in ("sword", "bow") else "wand")(self.next)
+            elif event[0] == "defeat":
+                self.player.sprite.die(self.game.game_over, "You Died")
+            elif event[0] == "victory":
+                if self.cave.cave_type == CaveType.BOSS:
+                    self.game.game_over("You Have Beaten The Game!")
+                self.player.coins += self.cave.reward
+                self.cave.reward = 0
+                self.cave.cave_type = CaveType.BLANK
+                self.exit()
+                self.cave.release()
+
+    def position(self, target):
+        # Screen position of the player or an enemy for damage numbers
+        if target == self.player:
+            return (self.game.offX * self.game.cell_size + 100,
+                    self.game.offY * self.game.cell_size - 16 + (
+                            self.game.screen.get_height() - self.game.offY * self.game.cell_size) // 2)
+        return target.button.rect.center
 
     def add_damage_display(self, x, y, amount, crit):
         # Add a damage display to the damage list for rendering
         if not amount:
             return
         font_size = 15
-        font = pygame.font.SysFont("Arial", font_size)
-        font.set_bold(crit)
-        colour = (random.randint(175, 255), random.randint(175, 255), random.randint(175, 255))
+        font = Fonts.get("Arial", font_size, crit)
+        rng = streams.cosmetics
+        colour = (rng.randint(175, 255), rng.randint(175, 255), rng.randint(175, 255))
+        # Damage numbers and their colours rarely repeat, so they are rendered without the text cache
         s = font.render(str(round(amount, 2)), True, colour)
-        x += random.randint(-20, 20)
-        y += random.randint(-20, 20)
-        self.damages.append([x, y, s, 252])
+        x += rng.randint(-20, 20)
+        y += rng.randint(-20, 20)
+        self.damages.append([x, y, s, 252])  # Alpha which fades by 180 a second
 
     def retreat(self, button):
         # Retreat from combat and exit the combat screen
@@ -95,7 +96,7 @@ class Combat:
     def setup(self):
         # Set up the combat screen with buttons for player actions
         self.game.alert.add_text("Press enemy to attack!", 5)
-        self.game.buttons["Combat"] = [
+        buttons = [
             Button(10, self.game.screen.get_height() - 40, 100, 30, "RETREAT", self.retreat, self.game.toggle_board)]
         self.player.canMove = False
         self.player.inCombat = True
@@ -107,82 +108,64 @@ class Combat:
             x = w - 5 * self.game.cell_size + ((i + 1) // 2) * self.game.cell_size // 4
             y = self.game.offY + (w - self.game.offY) // 2 + ((-1) ** (i % 2)) * (
                     (i + 1) // 2) * self.game.cell_size * 2
-            self.game.buttons["Combat"].append(
+            buttons.append(
                 Button(x, y, 32, 32, "", self.player_attack, self.enemies[i].display_stats, None, self.enemies[i]))
-            self.enemies[i].button = self.game.buttons["Combat"][-1]
+            self.enemies[i].button = buttons[-1]
+        # The group is assigned once it is complete so the button registry indexes all of it
+        self.game.buttons["Combat"] = buttons
         self.enemies.sort(key=lambda x: x.button.y)
     def exit(self):
         # Exit combat and return to the maze
         self.player.affected_dot = []
-        self.cave.enemies = self.enemies
+        # Return any enemies the engine has not removed yet to the pool
+        EnemyLoader.release([i for i in self.enemies if i.health <= 0])
+        self.cave.enemies = [i for i in self.enemies if i.health > 0]
         self.game.buttons["Combat"] = []
         self.game.combat = None
         self.player.canMove = True
         self.player.inCombat = False
         self.game.need_render_maze = True
 
+    def update(self, dt):
+        # Advance the animations and fade the damage numbers by the seconds passed
+        self.player.sprite.next(dt)
+        for i in self.enemies:
+            i.SpriteSheet.next(dt)
+        for i in self.damages:
+            i[3] -= 180 * dt
+        self.damages = [i for i in self.damages if i[3] > 0]
+
     def render(self):
-        # Update and draw the player's sprite
-        self.player.sprite.next()
-        player_sprite = pygame.transform.scale2x(self.player.sprite.get_sprite())
-        self.game.screen.blit(player_sprite, (self.game.offX * self.game.cell_size + 100,
-                                              self.game.offY * self.game.cell_size - 16 + (
-                                                      self.game.screen.get_height() - self.game.offY * self.game.cell_size) // 2))
+        # Draw the player's sprite
+        player_sprite = self.player.sprite.get_sprite(True)
+        # Everything drawn in combat is animated, so all of it is marked as changed
+        mark = self.game.compositor.mark
+        mark(self.game.screen.blit(player_sprite, (self.game.offX * self.game.cell_size + 100,
+                                                   self.game.offY * self.game.cell_size - 16 + (
+                                                           self.game.screen.get_height() - self.game.offY * self.game.cell_size) // 2)))
         # Iterate through each enemy and draw their sprites and health bars
         for i in self.game.buttons["Combat"]:
             if not isinstance(i.info, Enemy):
                 continue
-            sprite = i.info.SpriteSheet.get_sprite()
-            sprite = pygame.transform.scale2x(sprite)
-            self.game.screen.blit(sprite, (i.x - 16, i.y - 16))
+            sprite = i.info.SpriteSheet.get_sprite(True)
+            mark(self.game.screen.blit(sprite, (i.x - 16, i.y - 16)))
             w, h = i.rect.center
             x, y = i.info.HealthBar.get_size()
             i.info.update_health_bar()
-            self.game.screen.blit(i.info.HealthBar, (w - x // 2, h - i.rect.height))
-        for i in self.enemies:
-            i.SpriteSheet.next()
+            mark(self.game.screen.blit(i.info.HealthBar, (w - x // 2, h - i.rect.height)))
         # Render damage numbers with a fade effect
         for i in self.damages:
-            i[2].set_alpha(i[3])
-            self.game.screen.blit(i[2], (i[0], i[1]))
-            i[3] -= 3
-        self.damages = [i for i in self.damages if i[3] > 0]
+            i[2].set_alpha(int(i[3]))
+            mark(self.game.screen.blit(i[2], (i[0], i[1])))
 
     def player_attack(self, button):
         # Check if it's the player's turn; if not, exit the function
-        if not self.turn == self.player:
+        if not self.engine.player_turn():
             return
-        # Advance the turn index and ensure it wraps correctly around the turn queue
-        self.turnIdx += 1
-        self.turnIdx %= len(self.turnQueue)
-        # Update the current turn to the next entity in the turn queue
-        self.turn = self.turnQueue[self.turnIdx]
-        # Calculate damage and apply critical hit multiplier if applicable
-        if random.random() < self.player.weapon.critRate:
-            damage_dealt = self.player.damage * self.player.weapon.critDamage
-            self.add_damage_display(*button.rect.center, damage_dealt, True)
-        else:
-            damage_dealt = self.player.damage
-            self.add_damage_display(*button.rect.center, damage_dealt, False)
-        button.info.health -= damage_dealt
+        self.show(self.engine.player_attack(button.info))
         # Check if the enemy's health has dropped to zero or below
         if button.info.health <= 0:
             button.info.SpriteSheet.die(button.info.SpriteSheet.dead)
-        # Apply DOT effects if the weapon has any
-        button.info.affected_dot.append([self.player.damage * self.player.weapon.DOTDam, self.player.weapon.DOTTurns])
-        # Update the enemy's health bar to reflect the new health status
-        button.info.update_health_bar()
-        # Apply splash damage to nearby enemies if the weapon has any
-        button_idx = self.enemies.index(button.info)
-        spashDam = damage_dealt * self.player.weapon.splashDam
-        for i in range(len(self.enemies)):
-            if self.enemies[i] == button.info:
-                continue
-            if abs(i - button_idx) <= self.player.weapon.splashRange:
-                self.enemies[i].health -= spashDam
-                self.enemies[i].update_health_bar()
-                self.add_damage_display(*button.rect.center, spashDam, False)
-                self.enemies[i].button.info.affected_dot.append([spashDam*self.player.weapon.DOTDam, self.player.weapon.DOTTurns])
         # Trigger the player's attack animation based on the weapon type
         if self.player.weapon.weaponType == WeaponType.SWORDS:
             self.player.sprite.sword(self.next)
@@ -193,13 +176,23 @@ class Combat:
 
 
 class Game:
-    def __init__(self):
+    def __init__(self, seed=None, fps=60, idle=True):
         pygame.init()  # Initialize all imported pygame modules
         pygame.key.set_repeat(60)  # Set the delay before keys repeat during long presses
         # Load game settings from a JSON file
         with open(Path(__file__).resolve().with_name("settings.json"), mode="r", encoding="utf-8") as read_file:
             self.settings = json.load(read_file)
         self.clock = pygame.time.Clock()  # Clock object for controlling the game's framerate
+        self.fps = fps  # Most frames rendered per second
+        self.idle = idle  # Whether to sleep instead of rendering frames in which nothing would change
+        self.step = 1 / 60  # Seconds the game is updated by at a time, independent of the frames rendered
+        self.max_lag = 0.25  # Most seconds caught up with at once after a slow frame
+        self.lag = 0  # Seconds passed which the game has not been updated for yet
+        self.frames_rendered = 0
+        self.time_skipped = 0  # Seconds slept through because nothing changed
+        self.waited = []  # Event which ended the last wait, handled before the events still in the queue
+        self.cpu_time = 0  # Processor time used by the frames rendered and the sleeps between them
+        self.cpu_mark = time.process_time()
         # Define the game window's dimensions based on cell size and offsets
         self.width = 25
         self.height = 15
@@ -209,34 +202,55 @@ class Game:
         screen_size = ((self.width + self.offX) * self.cell_size, (self.height + self.offY) * self.cell_size)
         self.screen = pygame.display.set_mode(screen_size)  # Initialize the game window
         pygame.display.set_caption("Game")
-        self.font = pygame.font.SysFont("Arial", 50)
-        self.buttons = {}
+        self.font = Fonts.get("Arial", 50)
+        self.buttons = ButtonRegistry()
         self.combat = None
         self.need_render_stats = None
         self.need_render_maze = None
         self.maze = None
+        self.fog = None
+        self.maze_layer = None
+        self.path = None  # Distance field to the target of player.goto
+        self.path_key = None  # Target and maze version the distance field was computed for
+        self.cave_positions = None  # Positions of the Orc, Bat and Boss caves as arrays
+        self.info = ""  # Distances to the nearest caves shown by the alert
+        self.info_key = None  # Player position and cave version the distances were computed for
         self.gen = None
         self.player = None
         self.enemyLoader = None
         self.weaponLoader = None
         self.alert = None
-        self.menu()
+        self.compositor = Compositor(self.screen)  # Pushes the parts of the screen which changed to the display
+        self.stats_shown = None  # Stats drawn by render_stats and where their numbers are
+        self.stats_rects = []
+        self.seed = seed  # Master seed of the random streams, a new one is picked for every game if it is None
 
     def setup(self, button):
+        # Start a game of the difficulty selected (button.info) in the menu
+        self.new_game(button.info)
+        # The master seed is picked at random unless one was given, show it so the game can be played again
+        print(f"Seed {streams.seed}, run main.py {streams.seed} to play this game again")
+        # Start the main game loop
+        self.run_game()
+
+    def new_game(self, difficulty):
+        # Set up a game of the difficulty without entering the game loop, so it can also be simulated
         # Clear any existing menu buttons
         self.buttons["menu"] = []
-        # Load game settings based on the difficulty selected (button.info)
-        setting = self.settings[button.info]
+        # Load game settings based on the difficulty
+        setting = self.settings[difficulty]
+        # Start every random stream from the master seed so the same seed plays the same game
+        streams.reseed(self.seed)
         self.weaponLoader = WeaponLoader()
         # Determine a random starting position for the player within the maze
-        start = (random.randint(0, self.width // 2) * 2, random.randint(0, self.height // 2) * 2)
+        start = (streams.maze.randint(0, self.width // 2) * 2, streams.maze.randint(0, self.height // 2) * 2)
         # Initialize player
         self.player = Player(*start, setting["player"])
         # Set up the inventory button for the player's weapon
         self.buttons["inv"] = [
             Button(0, 0, self.cell_size, self.cell_size, self.weaponLoader.weapons[0].icon, self.equip_weapon,
                    self.display_stats, self.weaponLoader.weapons[0].background_colour,
-                   copy.copy(self.weaponLoader.weapons[0]))]
+                   Weapon(self.weaponLoader.weapons[0]))]
         self.buttons["inv"][0].selected = True
         # Assign the selected weapon to the player
         self.player.weaponButton = self.buttons["inv"][0]
@@ -246,25 +260,34 @@ class Game:
         # Generate a new maze based on the game settings
         self.gen = MazeGen(self.width, self.height, start, setting, self)
         self.maze = self.gen.getMaze()
+        self.fog = FogOfWar(self.maze, 5)
+        self.maze_layer = MazeLayer(self.maze, self.cell_size)
+        self.path_key = None
+        self.info_key = None
+        self.cave_positions = None
         # Initialize an alert system for in-game notifications
         self.alert = Alert(self)
         self.need_render_maze = True
         self.need_render_stats = True
         self.combat = None
-        # Start the main game loop
-        self.run_game()
+        self.move_player(Direction.NONE)
 
     def game_over(self, txt):
         # Game over screen and start new game
         global game
-        font = pygame.font.SysFont("Arial", 50)
+        font = Fonts.get("Arial", 50)
         self.screen.fill((0, 0, 0))
-        txt = font.render(txt, True, (255, 255, 255))
+        txt = Fonts.render(txt, font, (255, 255, 255))
         self.screen.blit(txt, (
             (self.screen.get_width() - txt.get_width()) // 2, (self.screen.get_height() - txt.get_height()) // 2))
+        seed = Fonts.render(f"Seed {streams.seed}", Fonts.get("Arial", 20), (255, 255, 255))
+        self.screen.blit(seed, ((self.screen.get_width() - seed.get_width()) // 2,
+                                (self.screen.get_height() + txt.get_height()) // 2 + 10))
         pygame.display.flip()
         time.sleep(2)
-        game = Game()
+        self.maze.release_enemies()
+        game = Game(fps=self.fps, idle=self.idle)
+        game.menu()
 
     def heal(self, _):
         # heal player and deduct coins
@@ -292,22 +315,20 @@ class Game:
         button.selected = True
         # Player's turn end if weapon is changed
         if self.combat:
-            self.combat.turnIdx += 1
-            self.combat.turnIdx %= len(self.combat.turnQueue)
-            self.combat.turn = self.combat.turnQueue[self.combat.turnIdx]
+            self.combat.engine.advance_turn()
             self.combat.next()
 
     def exit_cave(self, _):
         # exit cave
         self.need_render_maze = True
-        self.buttons[self.maze[self.player.x][self.player.y].cave_type] = []
+        self.buttons[self.maze.cave_type(self.player.x, self.player.y)] = []
         self.player.canMove = True
 
     def display_stats(self, button):
         # display weapon stats when mouse hovers over weapon
         surface = button.info.stats_surface
         x, y = pygame.mouse.get_pos()
-        self.screen.blit(surface, (min(self.screen.get_width() - surface.get_width(), x + 10), y))
+        self.compositor.mark(self.screen.blit(surface, (min(self.screen.get_width() - surface.get_width(), x + 10), y)))
 
     def update_inv(self):
         # update inventory button positions
@@ -317,6 +338,7 @@ class Game:
             _x = x + (self.cell_size + 3) * (c % 10)
             _y = y + (c // 10) * (self.cell_size + 3)
             self.buttons["inv"][c].move(_x, _y)
+        self.buttons.changed()
 
     def add_random_weapon(self, rarities):
         # checks if inventory is full
@@ -324,7 +346,7 @@ class Game:
             self.alert.add_text("Inventory Full", 1)
             return
         # adds a random weapon to the inventory
-        weapon = copy.copy(self.weaponLoader.get_random(rarities))
+        weapon = Weapon(self.weaponLoader.get_random(rarities))
         weapon.roll()
         self.buttons["inv"].append(
             Button(0, 0, self.cell_size, self.cell_size, weapon.icon, self.equip_weapon,
@@ -354,35 +376,34 @@ class Game:
 
     def node_effect(self):
         # Retrieve the current node the player is on
-        node = self.maze[self.player.x][self.player.y]
+        node = self.maze.cave(self.player.x, self.player.y)
+        if node is None:
+            return
         # Check the type of the cave and execute corresponding actions
         if node.cave_type == CaveType.BOSS:
             # If the cave is of type BOSS, initiate combat with the enemies in the cave
-            self.combat = Combat(self.player, node.enemies, self, node)
+            self.combat = Combat(self.player, node.populate(self.gen.enemyLoader), self, node)
         if node.cave_type == CaveType.BAT:
             # If the cave is of type BAT, teleport the player to a random location
             self.alert.add_text("A bat sent you to a random location", 1)
-            self.player.x, self.player.y = self.gen.caves[random.randint(0, len(self.gen.caves) - 1)]
+            self.player.x, self.player.y = self.gen.caves[streams.maze.randint(0, len(self.gen.caves) - 1)]
             self.move_player(Direction.NONE)
         if node.cave_type == CaveType.SHOP:
             # If the cave is of type SHOP, display shop options and disable player movement
             self.player.canMove = False
-            self.buttons[CaveType.SHOP] = []
             self.need_render_maze = False
             # Add buttons for shop actions
-            self.buttons[CaveType.SHOP].append(
-                Button(450, 200, 330, 30, "Buy Health Buff (10 coins)", self.health_buff, self.toggle_board))
-            self.buttons[CaveType.SHOP].append(
-                Button(450, 250, 330, 30, "Buy Healing Potion (10 coins)", self.heal, self.toggle_board))
-            self.buttons[CaveType.SHOP].append(
-                Button(450, 300, 330, 30, "Buy Random Weapon (15 coins)", self.buy_random_weapon, self.toggle_board))
-            self.buttons[CaveType.SHOP].append(Button(450, 450, 300, 30, "Exit", self.exit_cave, self.toggle_board))
+            self.buttons[CaveType.SHOP] = [
+                Button(450, 200, 330, 30, "Buy Health Buff (10 coins)", self.health_buff, self.toggle_board),
+                Button(450, 250, 330, 30, "Buy Healing Potion (10 coins)", self.heal, self.toggle_board),
+                Button(450, 300, 330, 30, "Buy Random Weapon (15 coins)", self.buy_random_weapon, self.toggle_board),
+                Button(450, 450, 300, 30, "Exit", self.exit_cave, self.toggle_board)]
         if node.cave_type == CaveType.HOLE:
             # If the cave is of type HOLE, end the game with a loss message
             self.game_over("You fell into a bottomless hole")
         if node.cave_type == CaveType.ORC:
             # If the cave is of type ORC, initiate combat with the enemies in the cave
-            self.combat = Combat(self.player, node.enemies, self, node)
+            self.combat = Combat(self.player, node.populate(self.gen.enemyLoader), self, node)
         if node.cave_type == CaveType.REWARD:
             # If the cave is of type REWARD, grant the player a reward and reset the cave type
             self.alert.add_text("You Received a Reward", 1)
@@ -400,32 +421,19 @@ class Game:
             self.player.goto = (None, None)
         # Update player's facing direction and initiate walking animation if moving
         if direction != Direction.NONE:
-            self.player.actioning = 5
+            self.player.actioning = 5 / 60
             self.player.facing = direction
             self.player.sprite.walk(direction)
         # Calculate new position based on direction
         nx = self.player.x + direction.value[0]
         ny = self.player.y + direction.value[1]
         # Move player if new position is within bounds and not a wall
-        if 0 <= nx < self.gen.width and 0 <= ny < self.gen.height and self.maze[nx][ny].type != MazeNodeType.WALL:
+        if self.maze.is_open(nx, ny):
             self.player.x, self.player.y = nx, ny
         else:
             return
-        # Using bfs to reveal nearby maze nodes within a certain range
-        visited = np.zeros((self.width, self.height), dtype=bool)
-        q = deque()
-        q.append([(self.player.x, self.player.y), 0])
-        while len(q):
-            [(x, y), c] = q.popleft()
-            visited[x][y] = True
-            if c > 5:
-                continue
-            self.maze[x][y].visible = True
-            for i in Direction:
-                [nx, ny] = np.add([x, y], i.value)
-                if 0 <= ny < self.gen.height and 0 <= nx < self.gen.width and self.maze[nx][
-                    ny].type != MazeNodeType.WALL and not visited[nx][ny]:
-                    q.append([(nx, ny), c + 1])
+        # Reveal nearby maze nodes within a certain walking distance
+        self.fog.reveal(self.player.x, self.player.y)
         # Trigger node effects (e.g., combat, rewards) at the new position
         self.node_effect()
 
@@ -434,9 +442,7 @@ class Game:
         if not self.player.canMove:
             return
         # Validate the target position is within bounds, not a wall, visible, and rendering is needed
-        if not (0 <= pos[0] < self.gen.width and 0 <= pos[1] < self.gen.height and self.maze[pos[0]][
-            pos[1]].type != MazeNodeType.WALL and self.maze[pos[0]][
-                    pos[1]].visible and self.need_render_maze):
+        if not (self.maze.is_open(*pos) and self.maze.is_visible(*pos) and self.need_render_maze):
             return
         # If the target position is the current player position, reset the goto attribute
         if pos == [self.player.x, self.player.y]:
@@ -444,57 +450,53 @@ class Game:
             return
         # Set the target position as the new goto attribute for the player
         self.player.goto = pos
-        # Initialize a queue for BFS and visited array to keep track of visited nodes
-        q = deque()
-        q.append(pos)
-        visited = np.zeros((self.width, self.height), dtype=bool)
-        # Perform BFS to find the shortest path to the target position
-        while len(q):
-            x, y = q.popleft()
-            assert (self.maze[x][y].type != MazeNodeType.WALL)
-            visited[x][y] = True
-            for i in Direction:
-                [nx, ny] = np.add([x, y], i.value)
-                # If the next position is the player's current position, move the player in the opposite direction
-                if nx == self.player.x and ny == self.player.y:
-                    self.move_player(i.opposite(), True)
-                    return
-                # If the next position is valid and not visited, add it to the queue
-                if 0 <= nx < self.gen.width and 0 <= ny < self.gen.height and self.maze[nx][
-                    ny].type != MazeNodeType.WALL and self.maze[nx][
-                    ny].visible and not visited[nx][ny]:
-                    q.append((nx, ny))
+        # The distance field to the target is only computed again when the target or the visible nodes change
+        key = (tuple(pos), self.maze.version)
+        if self.path_key != key:
+            self.path = self.maze.distances_to(*pos)
+            self.path_key = key
+        # Take one step along the shortest path, stop if the target cannot be reached
+        direction = self.maze.step_towards(self.path, self.player.x, self.player.y)
+        if direction is None:
+            self.player.goto = (None, None)
+            return
+        self.move_player(direction, True)
 
     def toggle_board(self, button):
         # Toggle the boards of buttons
-        pygame.draw.rect(self.screen, (255, 255, 255), button.top_rect)
-        pygame.draw.rect(self.screen, (255, 255, 255), button.bottom_rect)
+        self.compositor.mark(pygame.draw.rect(self.screen, (255, 255, 255), button.top_rect))
+        self.compositor.mark(pygame.draw.rect(self.screen, (255, 255, 255), button.bottom_rect))
 
     def get_info(self):
-        # Get the distance to the nearest enemies
-        dist_to_boss = float('inf')
-        dist_to_orc = float('inf')
-        dist_to_bat = float('inf')
-        for x, y in self.gen.caves:
+        # Get the distance to the nearest enemies, only computed again when the player moves or a cave changes
+        key = (self.player.x, self.player.y, self.maze.cave_version)
+        if key == self.info_key:
+            return self.info
+        if self.info_key is None or self.info_key[2] != self.maze.cave_version:
+            # Group the cave positions by type again
+            positions = np.array(self.gen.caves, dtype=float).reshape(-1, 2)
+            types = self.maze.cave_types[tuple(positions.astype(np.intp).T)]
+            self.cave_positions = {cave_type: positions[types == cave_type.value]
+                                   for cave_type in (CaveType.ORC, CaveType.BOSS, CaveType.BAT)}
+        self.info_key = key
+        distances = {}
+        for cave_type, positions in self.cave_positions.items():
             # Calculate the minimum Euclidean distance to enemies
-            if self.maze[x][y].cave_type == CaveType.ORC:
-                dist_to_orc = min(dist_to_orc, math.hypot(x - self.player.x, y - self.player.y))
-            if self.maze[x][y].cave_type == CaveType.BOSS:
-                dist_to_boss = min(dist_to_boss, math.hypot(x - self.player.x, y - self.player.y))
-            if self.maze[x][y].cave_type == CaveType.BAT:
-                dist_to_bat = min(dist_to_bat, math.hypot(x - self.player.x, y - self.player.y))
-        # Round up the distances to a multiple of 5
-        dist_to_bat = ((dist_to_bat - 1) // 5 + 1) * 5
-        dist_to_boss = ((dist_to_boss - 1) // 5 + 1) * 5
-        dist_to_orc = ((dist_to_orc - 1) // 5 + 1) * 5
+            dist = np.hypot(positions[:, 0] - self.player.x, positions[:, 1] - self.player.y).min() \
+                if len(positions) else float('inf')
+            # Round up the distances to a multiple of 5
+            distances[cave_type] = ((dist - 1) // 5 + 1) * 5
+        dist_to_orc, dist_to_bat, dist_to_boss = (distances[CaveType.ORC], distances[CaveType.BAT],
+                                                  distances[CaveType.BOSS])
         # Return the distances to the enemies as a string
-        return ("" if math.isnan(dist_to_orc) else f"Orc ~{int(dist_to_orc)}m. ") + (
+        self.info = ("" if math.isnan(dist_to_orc) else f"Orc ~{int(dist_to_orc)}m. ") + (
             "" if math.isnan(dist_to_bat) else f"Bat ~{int(dist_to_bat)}m. ") + (
             "" if math.isnan(dist_to_boss) else f"Boss ~{int(dist_to_boss)}m.")
+        return self.info
 
     def manage_input(self):
         # Process all events from the event queue
-        for event in pygame.event.get():
+        for event in self.get_events():
             # Close the game if the quit event is triggered
             if event.type == pygame.QUIT:
                 exit(0)
@@ -515,53 +517,46 @@ class Game:
                 pos = [x // self.cell_size - self.offX, y // self.cell_size - self.offY]
                 # Attempt to move the player to the clicked position
                 self.go(pos)
-                # Check if any UI button is clicked and trigger its callback
-                for arr in self.buttons.values():
-                    for button in arr:
-                        if button.x < x < button.x + button.w and button.y < y < button.y + button.h:
-                            button.callback(button)
+                # Check if a UI button is clicked and trigger its callback
+                button = self.buttons.at(x, y)
+                if button is not None:
+                    button.callback(button)
             # Handle mouse movement for UI button hover effects
             if event.type == pygame.MOUSEMOTION:
-                x, y = pygame.mouse.get_pos()
-                # Toggle button hover state based on mouse position
-                for arr in self.buttons.values():
-                    for button in arr:
-                        button.toggled = button.x < x < button.x + button.w and button.y < y < button.y + button.h
+                self.buttons.hover(*pygame.mouse.get_pos())
 
-        # Process button toggle actions outside the event loop
-        for arr in self.buttons.values():
-            for button in arr:
-                if button.toggle and button.toggled:
-                    button.toggle(button)
 
     def render_maze(self):
-        # Render the maze grid, colour is stored in the maze node class
-        for y in range(self.height):
-            for x in range(self.width):
-                rect = pygame.Rect((x + self.offX) * self.cell_size, (y + self.offY) * self.cell_size,
-                                   self.cell_size, self.cell_size)
-                pygame.draw.rect(self.screen, self.maze[x, y].colour(), rect)
-        # Handle rendering of the player sprite and animation
-        if self.player.actioning:
-            self.player.actioning -= 1
-        else:
-            self.player.sprite.idle(self.player.facing)
-        self.player.sprite.next()
+        # Render the maze layer, only the cells which changed are drawn again
+        for x, y in self.maze.dirty:
+            self.compositor.mark(((x + self.offX) * self.cell_size, (y + self.offY) * self.cell_size,
+                                  self.cell_size, self.cell_size))
+        self.screen.blit(self.maze_layer.update(), (self.offX * self.cell_size, self.offY * self.cell_size))
+        # Handle rendering of the player sprite
         sprite = self.player.sprite.get_sprite()
-        self.screen.blit(sprite,
-                         ((self.player.x + self.offX) * self.cell_size, (self.player.y + self.offY) * self.cell_size))
+        # The player is animated, the tile it left is cleared by the marks of the last frame
+        self.compositor.mark(self.screen.blit(sprite, ((self.player.x + self.offX) * self.cell_size,
+                                                       (self.player.y + self.offY) * self.cell_size)))
 
     def render_stats(self):
         # Render the player's stats
         stats = [(self.player.coinIcon, self.player.coins),
                  (self.player.healthIcon, f"{round(self.player.health, 2)}/{round(self.player.maxHealth, 2)}"),
                  (self.player.damIcon, round(self.player.damage, 2))]
+        rects = []
         for c, (img, val) in enumerate(stats):
             img = pygame.transform.scale(img, (
                 self.cell_size * self.offY / len(stats), self.cell_size * self.offY / len(stats)))
-            num = self.font.render(str(val), True, (255, 255, 255))
-            self.screen.blit(num, (75, c * self.offY * self.cell_size / len(stats)))
+            num = Fonts.render(str(val), self.font, (255, 255, 255))
+            rects.append(self.screen.blit(num, (75, c * self.offY * self.cell_size / len(stats))))
             self.screen.blit(img, (0, c * self.offY * self.cell_size / len(stats)))
+        # Only the numbers change, the old ones are cleared and the new ones shown when any of them changes
+        values = tuple(val for _, val in stats)
+        if values != self.stats_shown:
+            for rect in self.stats_rects + rects:
+                self.compositor.mark(rect)
+            self.stats_shown = values
+            self.stats_rects = rects
 
     def render_buttons(self):
         for arr in self.buttons.values():
@@ -574,7 +569,64 @@ class Game:
                     width = button.w + 2 * border_thickness
                     height = button.h + 2 * border_thickness
                     rect = pygame.Rect(button.x - border_thickness, button.y - border_thickness, width, height)
-                    pygame.draw.rect(self.screen, (255, 0, 0), rect, border_thickness)
+                    self.compositor.mark(pygame.draw.rect(self.screen, (255, 0, 0), rect, border_thickness))
+
+    def update(self, dt):
+        # Advance the game by dt seconds, everything which changes over time is updated here and not when rendering
+        self.alert.update(dt)
+        if self.need_render_maze:
+            # Walk animation of the player, back to idle once it is over
+            if self.player.actioning > 1e-9:
+                self.player.actioning -= dt
+            else:
+                self.player.sprite.idle(self.player.facing)
+            self.player.sprite.next(dt)
+        if self.combat:
+            self.combat.update(dt)
+        if self.player.goto != (None, None):
+            self.go(self.player.goto)
+
+    def simulate(self, seconds):
+        # Run the game for the seconds without rendering or waiting, as fast as the processor allows.
+        # Input already in the event queue is handled on the first step. The game is set up with new_game first
+        for _ in range(round(seconds / self.step)):
+            self.manage_input()
+            self.update(self.step)
+
+    def idle_time(self):
+        # Seconds which can be slept through because nothing on the screen would change, 0 while anything moves.
+        # Input is not known in advance, the wait ends when it arrives
+        if self.combat or self.player.goto != (None, None):
+            return 0
+        seconds = self.alert.idle_time()
+        if self.need_render_maze:
+            if self.player.actioning > 1e-9:
+                return 0
+            seconds = min(seconds, self.player.sprite.idle_time())
+        return seconds
+
+    def wait(self, seconds):
+        # Sleep until an event arrives or the seconds have passed, returns the seconds which passed
+        start_time = time.perf_counter()
+        if seconds == float("inf"):
+            event = pygame.event.wait()
+        else:
+            # A timeout of 0 would wait forever
+            event = pygame.event.wait(max(int(seconds * 1000), 1))
+        # Keep the event for the frame to handle, posting it again would put it behind the events after it
+        if event.type != pygame.NOEVENT:
+            self.waited.append(event)
+        return min(seconds, time.perf_counter() - start_time)
+
+    def get_events(self):
+        # Events in the order they arrived, starting with the one taken off the queue by wait
+        events = self.waited + pygame.event.get()
+        self.waited = []
+        return events
+
+    def cpu_per_frame(self):
+        # Mean processor time in seconds for each frame rendered
+        return self.cpu_time / self.frames_rendered if self.frames_rendered else 0
 
     def menu(self):
         # Initialize the menu screen with difficulty selection buttons
@@ -585,40 +637,50 @@ class Game:
         running = True
         # Manage input of the menu screen loop
         while running:
-            self.clock.tick(60)
+            self.clock.tick(self.fps)
             self.screen.fill((0, 0, 0))
             self.render_buttons()
-            for event in pygame.event.get():
+            # Nothing on the menu moves by itself, so it only has to be drawn again after input
+            if self.idle and self.frames_rendered and not self.waited and not pygame.event.peek():
+                self.wait(float("inf"))
+            self.frames_rendered += 1
+            for event in self.get_events():
                 if event.type == pygame.QUIT:
                     exit(0)
                 if event.type == pygame.MOUSEBUTTONDOWN:
-                    x, y = pygame.mouse.get_pos()
-                    for arr in self.buttons.values():
-                        for button in arr:
-                            if button.x < x < button.x + button.w and button.y < y < button.y + button.h:
-                                button.callback(button)
+                    button = self.buttons.at(*pygame.mouse.get_pos())
+                    if button is not None:
+                        button.callback(button)
                 if event.type == pygame.MOUSEMOTION:
-                    x, y = pygame.mouse.get_pos()
-                    for arr in self.buttons.values():
-                        for button in arr:
-                            button.toggled = button.x < x < button.x + button.w and button.y < y < button.y + button.h
-            for arr in self.buttons.values():
-                for button in arr:
-                    if button.toggled:
-                        button.toggle(button)
+                    self.buttons.hover(*pygame.mouse.get_pos())
+            self.buttons.toggle_hovered()
             pygame.display.flip()
 
     def run_game(self):
         # Main game loop
-        self.move_player(Direction.NONE)
+        self.cpu_mark = time.process_time()
         frame = 0
         running = True
         while running:
-            # Update the game's clock and clear the screen
-            self.clock.tick(60)
-            self.screen.fill((0, 0, 0))
+            # Sleep through the time in which nothing would change until input arrives, the timers are moved on
+            # by the time slept in one update as nothing they do would show
+            skipped = 0
+            if self.idle:
+                seconds = self.idle_time()
+                if seconds > 1e-9 and not self.waited and not pygame.event.peek():
+                    skipped = self.wait(seconds)
+                    self.time_skipped += skipped
+                    self.update(skipped)
+            # Update the game's clock, the time passed since the last frame is caught up with in fixed steps.
+            # Frames are dropped when rendering is slow, the game speed stays the same
+            self.lag += min(max(self.clock.tick(self.fps) / 1000 - skipped, 0), self.max_lag)
+            self.manage_input()
+            while self.lag >= self.step:
+                self.update(self.step)
+                self.lag -= self.step
             frame += 1
             # Render the maze, stats, buttons, and alert system
+            self.screen.fill((0, 0, 0))
             self.render_buttons()
             self.alert.render()
             if self.need_render_maze:
@@ -627,12 +689,20 @@ class Game:
                 self.render_stats()
             if self.combat:
                 self.combat.render()
-            self.manage_input()
-            if self.player.goto != (None, None):
-                self.go(self.player.goto)
-            pygame.display.flip()
+            # The hovered button's toggle draws over everything else
+            self.buttons.toggle_hovered()
+            # Entering or leaving combat or a shop and changes to the buttons redraw the whole display
+            self.compositor.present((self.need_render_maze, self.need_render_stats, self.combat is not None,
+                                     self.buttons.version))
+            self.frames_rendered += 1
+            cpu = time.process_time()
+            self.cpu_time += cpu - self.cpu_mark
+            self.cpu_mark = cpu
 
         pygame.quit()
 
 
-game = Game()
+if __name__ == "__main__":
+    # A master seed can be passed on the command line to play the same game again, followed by a frame rate cap
+    game = Game(int(sys.argv[1]) if len(sys.argv) > 1 else None, int(sys.argv[2]) if len(sys.argv) > 2 else 60)
+    game.menu()
@@ -0,0 +1,225 @@
+import random
+import numpy as np
+
+WALL = 0
+OPEN = 1
+
+
+def count_neighbours(open_cells):
+    # Counts the open neighbours of every cell at once using shifted views of a padded copy
+    padded = np.pad(open_cells, 1).astype(np.int8)
+    return padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]
+
+
+class MazeAlgorithm:
+    # Carves a perfect maze into a (width, height) int8 grid where 0 is a wall and 1 is open.
+    # Cells lined up with the start on every other row and column are the rooms of the maze and
+    # the cells in between them become the passages
+    name = None
+
+    def __init__(self, rng=random):
+        self.rng = rng  # Random module or random.Random the maze is carved with
+
+    def carve(self, width, height, start):
+        raise NotImplementedError
+
+    @staticmethod
+    def lattice(width, height, start):
+        # Returns the offset of the first room and the number of rooms in each direction
+        ox, oy = start[0] % 2, start[1] % 2
+        return ox, oy, (width - ox + 1) // 2, (height - oy + 1) // 2
+
+    def seed(self):
+        # Seed for the NumPy generator so the random generator of the algorithm still decides the maze
+        return self.rng.getrandbits(64)
+
+    def build_grid(self, width, height, start, right, down):
+        # Expands the passages between rooms into a grid, right[i, j] joins room (i, j) with (i + 1, j)
+        # and down[i, j] joins room (i, j) with (i, j + 1)
+        ox, oy, cols, rows = self.lattice(width, height, start)
+        grid = np.zeros((width, height), dtype=np.int8)
+        grid[ox:ox + 2 * cols:2, oy:oy + 2 * rows:2] = OPEN
+        grid[ox + 1:ox + 2 * cols - 1:2, oy:oy + 2 * rows:2] = right
+        grid[ox:ox + 2 * cols:2, oy + 1:oy + 2 * rows - 1:2] = down
+        return grid
+
+
+class DepthFirst(MazeAlgorithm):
+    # Randomised depth first search, long winding corridors and few dead ends
+    name = "dfs"
+
+    def carve(self, width, height, start):
+        # The search uses an explicit stack instead of recursion, so the size of the maze is not limited by the
+        # call stack. Cells are stored in a flat bytearray with a 2 cell border of visited sentinels,
+        # which removes the bounds checks when looking 2 cells ahead
+        padded_height = height + 4
+        border = np.full((width + 4, padded_height), 255, dtype=np.uint8)
+        border[2:-2, 2:-2] = WALL
+        grid = bytearray(border.tobytes())
+        # Offsets of the 4 neighbouring cells in the flat grid
+        down, up, left, right = 2, -2, -2 * padded_height, 2 * padded_height
+        rand = self.rng.random
+        idx = (start[0] + 2) * padded_height + start[1] + 2
+        grid[idx] = OPEN
+        stack = [idx]
+        while stack:
+            idx = stack[-1]
+            options = []
+            if not grid[idx + down]:
+                options.append(down)
+            if not grid[idx + up]:
+                options.append(up)
+            if not grid[idx + left]:
+                options.append(left)
+            if not grid[idx + right]:
+                options.append(right)
+            if not options:
+                stack.pop()
+                continue
+            step = options[int(rand() * len(options))]
+            # Open the wall in between and move to the next cell
+            grid[idx + step // 2] = OPEN
+            grid[idx + step] = OPEN
+            stack.append(idx + step)
+        # Strip the border
+        grid = np.frombuffer(grid, dtype=np.uint8).reshape(width + 4, padded_height)
+        return grid[2:-2, 2:-2].astype(np.int8)
+
+
+class Kruskal(MazeAlgorithm):
+    # Randomised Kruskal, passages are opened in random order unless they would join rooms that are already
+    # connected, which is tracked with a union-find. Many short dead ends
+    name = "kruskal"
+
+    def carve(self, width, height, start):
+        ox, oy, cols, rows = self.lattice(width, height, start)
+        # Room (i, j) has the id i * rows + j, the first passages join rooms to the right and the rest downwards
+        right_count = (cols - 1) * rows
+        below = np.arange(cols * rows).reshape(cols, rows)[:, :-1].ravel()
+        first = np.concatenate((np.arange(right_count), below))
+        second = np.concatenate((np.arange(right_count) + rows, below + 1))
+        order = np.random.default_rng(self.seed()).permutation(len(first))
+        parent = list(range(cols * rows))
+        opened = bytearray(len(first))
+        joins = cols * rows - 1
+        for edge, a, b in zip(order.tolist(), first[order].tolist(), second[order].tolist()):
+            if not joins:
+                break
+            # Find the roots with path halving
+            while parent[a] != a:
+                parent[a] = a = parent[parent[a]]
+            while parent[b] != b:
+                parent[b] = b = parent[parent[b]]
+            if a != b:
+                parent[a] = b
+                opened[edge] = 1
+                joins -= 1
+        opened = np.frombuffer(opened, dtype=np.uint8)
+        return self.build_grid(width, height, start, opened[:right_count].reshape(cols - 1, rows),
+                               opened[right_count:].reshape(cols, rows - 1))
+
+
+class Wilson(MazeAlgorithm):
+    # Wilson's algorithm, loop erased random walks from every room until they hit the maze.
+    # Picks uniformly between every possible maze, so it has no bias towards long or short corridors
+    name = "wilson"
+
+    def carve(self, width, height, start):
+        ox, oy, cols, rows = self.lattice(width, height, start)
+        size = cols * rows
+        rand = self.rng.random
+        in_maze = bytearray(size)
+        in_maze[int(rand() * size)] = 1
+        # The room the walk last left each room towards, overwriting it erases any loop in the walk
+        towards = [0] * size
+        right = np.zeros(((cols - 1) * rows), dtype=np.int8)
+        down = np.zeros((cols * (rows - 1)), dtype=np.int8)
+        for room in range(size):
+            # Random walk until a room in the maze is reached
+            idx = room
+            while not in_maze[idx]:
+                direction = int(rand() * 4)
+                if direction == 0:
+                    if idx < size - rows:
+                        towards[idx] = idx = idx + rows
+                elif direction == 1:
+                    if idx >= rows:
+                        towards[idx] = idx = idx - rows
+                elif direction == 2:
+                    if idx % rows != rows - 1:
+                        towards[idx] = idx = idx + 1
+                elif idx % rows:
+                    towards[idx] = idx = idx - 1
+            # Follow the loop erased walk and add it to the maze
+            idx = room
+            while not in_maze[idx]:
+                in_maze[idx] = 1
+                nxt = towards[idx]
+                low = min(idx, nxt)
+                if abs(nxt - idx) == rows:
+                    right[low] = OPEN
+                else:
+                    down[low - low // rows] = OPEN
+                idx = nxt
+        return self.build_grid(width, height, start, right.reshape(cols - 1, rows), down.reshape(cols, rows - 1))
+
+
+class Eller(MazeAlgorithm):
+    # Eller's algorithm, builds the maze one row at a time and only remembers which rooms of the current row are
+    # connected, so rows can be streamed for mazes of any height
+    name = "eller"
+
+    def carve(self, width, height, start):
+        return np.stack(list(self.rows(width, height, start)), axis=1)
+
+    def rows(self, width, height, start):
+        # Yields the maze one row of cells at a time, each row has width cells
+        ox, oy, cols, rows = self.lattice(width, height, start)
+        rand = self.rng.random
+        if oy:
+            yield np.zeros(width, dtype=np.int8)
+        # Set of each room in the current row and the rooms of the row in each set
+        sets = list(range(cols))
+        members = {i: [i] for i in range(cols)}
+        next_set = cols
+        for j in range(rows):
+            last = j == rows - 1
+            row = np.zeros(width, dtype=np.int8)
+            row[ox:ox + 2 * cols:2] = OPEN
+            # Randomly join neighbouring rooms which are not connected yet, the last row joins all of them
+            for i in range(cols - 1):
+                a, b = sets[i], sets[i + 1]
+                if a != b and (last or rand() < 0.5):
+                    row[ox + 2 * i + 1] = OPEN
+                    # Move the smaller set into the larger one
+                    if len(members[a]) < len(members[b]):
+                        a, b = b, a
+                    for k in members[b]:
+                        sets[k] = a
+                    members[a] += members.pop(b)
+            yield row
+            if last:
+                break
+            # Every set continues into the next row through at least one passage downwards
+            row = np.zeros(width, dtype=np.int8)
+            carried = bytearray(cols)
+            for group in members.values():
+                carried[group[int(rand() * len(group))]] = 1
+                for k in group:
+                    if rand() < 0.5:
+                        carried[k] = 1
+            # Rooms which are not carried down start in a new set of their own
+            members = {}
+            for i in range(cols):
+                if carried[i]:
+                    row[ox + 2 * i] = OPEN
+                else:
+                    sets[i] = next_set
+                    next_set += 1
+                members.setdefault(sets[i], []).append(i)
+            yield row
+        for _ in range(height - oy - 2 * rows + 1):
+            yield np.zeros(width, dtype=np.int8)
+
+
+ALGORITHMS = {algorithm.name: algorithm for algorithm in (DepthFirst, Kruskal, Wilson, Eller)}
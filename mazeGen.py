@@ -1,5 +1,9 @@
+import time
+import random
+from collections import deque
 import numpy as np
 from characters import *
+from mazeAlgorithms import ALGORITHMS, count_neighbours
 
 
 class MazeNodeType(enum.Enum):
@@ -30,22 +34,40 @@ class MazeNode:
     """
     colours = [(0, 0, 0), (255, 255, 255), (127, 127, 127), (0, 242, 65), (242, 0, 0), (43, 43, 43)]
 
-    def __init__(self, type):
-        self.type = type
-        self.visible = False
-        self.cave_type = None
+    @staticmethod
+    def colour(type, visible):
+        # Returns the colour of a node based on its type
+        if visible:
+            return MazeNode.colours[type]
+        else:
+            return MazeNode.colours[0]
+
+
+class Cave:
+    # Side table entry holding the enemies and reward of a cave, only dead ends have one.
+    # Caves with enemies only keep how many of each enemy they have until the player enters them
+    __slots__ = ("maze", "x", "y", "spawn", "enemies", "reward")
+    # Order the enemies are created in, which is also the order of their turns
+    spawn_order = ["Orc Leader", "Orc Soldier", "Orc Mage", "Orc Grunt", "Orc Villager"]
+
+    def __init__(self, maze, x, y):
+        self.maze = maze
+        self.x = x
+        self.y = y
+        self.spawn = None  # Number of each enemy in spawn_order, None once the enemies are created
         self.enemies = []
         self.reward = 0
 
-    def colour(self):
-        # Returns the colour of the node based on its type
-        if self.visible:
-            return self.colours[self.type.value]
-        else:
-            return self.colours[0]
+    @property
+    def cave_type(self):
+        return self.maze.cave_type(self.x, self.y)
+
+    @cave_type.setter
+    def cave_type(self, cave_type):
+        self.maze.set_cave_type(self.x, self.y, cave_type)
 
-    def setup_cave(self, enemyLoader, setting):
-        # Configures the node with enemies and rewards based on the cave type and provided settings
+    def setup_cave(self, setting, rng=random):
+        # Configures the cave with the number of enemies and rewards based on the cave type and provided settings
         if self.cave_type == CaveType.ORC:
             setting = setting["Orc"]
             self.reward = 20
@@ -54,24 +76,341 @@ class MazeNode:
             self.reward = 500
         else:
             return
-        # Generate enemies with new enemy objects
-        for i in range(random.randint(*setting["Orc Leader"])):
-            self.enemies.append(enemyLoader.get_enemy("Orc Leader"))
-        for i in range(random.randint(*setting["Orc Soldier"])):
-            self.enemies.append(enemyLoader.get_enemy("Orc Soldier"))
-        for i in range(random.randint(*setting["Orc Mage"])):
-            self.enemies.append(enemyLoader.get_enemy("Orc Mage"))
-        for i in range(random.randint(*setting["Orc Grunt"])):
-            self.enemies.append(enemyLoader.get_enemy("Orc Grunt"))
-        for i in range(random.randint(*setting["Orc Villager"])):
-            self.enemies.append(enemyLoader.get_enemy("Orc Villager"))
+        self.spawn = tuple(rng.randint(*setting[name]) for name in self.spawn_order)
+
+    def populate(self, enemyLoader):
+        # Creates the enemies of the cave the first time it is entered and returns them
+        if self.spawn is not None:
+            for name, count in zip(self.spawn_order, self.spawn):
+                for i in range(count):
+                    self.enemies.append(enemyLoader.get_enemy(name))
+            self.spawn = None
+        return self.enemies
+
+    def release(self):
+        # Drops the enemies once the cave is cleared
+        self.spawn = None
+        self.enemies = []
+
+
+class Maze:
+    # The maze is stored as parallel typed arrays indexed by [x, y] instead of an array of node objects
+    NO_CAVE = -1
+
+    def __init__(self, types):
+        self.width, self.height = types.shape
+        self.types = types  # MazeNodeType values
+        self.visible = np.zeros(types.shape, dtype=bool)
+        self.cave_types = np.full(types.shape, self.NO_CAVE, dtype=np.int8)  # CaveType values
+        self.caves = {}  # (x, y) -> Cave
+        self.version = 0  # Increases whenever a cell becomes visible
+        self.cave_version = 0  # Increases whenever the type of a cave changes
+        self.dirty = []  # Cells whose colour changed since the maze was last drawn
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def is_open(self, x, y):
+        # Whether the position is inside the maze and can be walked on
+        return self.in_bounds(x, y) and self.types[x, y] != MazeNodeType.WALL.value
+
+    def is_visible(self, x, y):
+        return self.visible[x, y]
+
+    def reveal(self, cells):
+        # Makes the cells visible, every change to visibility goes through here so the cells are drawn again
+        # and anything computed from the visible cells is computed again
+        cells = [(x, y) for x, y in cells if not self.visible[x, y]]
+        if cells:
+            for x, y in cells:
+                self.visible[x, y] = True
+            self.dirty += cells
+            self.version += 1
+        return cells
+
+    def distances_to(self, x, y):
+        # Breadth first search from the position over the visible open cells.
+        # Returns the number of steps from every cell to the position, -1 where it cannot be reached
+        distances = np.full(self.types.shape, -1, dtype=np.int32)
+        walkable = (self.types != MazeNodeType.WALL.value) & self.visible
+        distances[x, y] = 0
+        q = deque([(x, y)])
+        while q:
+            x, y = q.popleft()
+            for dx, dy in ((0, 1), (0, -1), (-1, 0), (1, 0)):
+                nx, ny = x + dx, y + dy
+                if self.in_bounds(nx, ny) and walkable[nx, ny] and distances[nx, ny] < 0:
+                    distances[nx, ny] = distances[x, y] + 1
+                    q.append((nx, ny))
+        return distances
+
+    def step_towards(self, distances, x, y):
+        # Returns the direction of the next step on a shortest path in the distance field, None without a path
+        if distances[x, y] <= 0:
+            return None
+        for direction in Direction:
+            nx, ny = x + direction.value[0], y + direction.value[1]
+            if self.in_bounds(nx, ny) and distances[nx, ny] == distances[x, y] - 1:
+                return direction
+
+    def colour(self, x, y):
+        return MazeNode.colour(self.types[x, y], self.visible[x, y])
+
+    def cave_type(self, x, y):
+        cave_type = self.cave_types[x, y]
+        return None if cave_type == self.NO_CAVE else CaveType(cave_type)
+
+    def set_cave_type(self, x, y, cave_type):
+        self.cave_types[x, y] = self.NO_CAVE if cave_type is None else cave_type.value
+        self.cave_version += 1
+
+    def add_caves(self, positions, cave_types):
+        # Writes the types of all caves to the arrays at once and creates their side table entries
+        xs, ys = np.array(positions, dtype=np.intp).reshape(-1, 2).T
+        self.cave_types[xs, ys] = [cave_type.value for cave_type in cave_types]
+        for x, y in positions:
+            self.caves[(x, y)] = Cave(self, x, y)
+        self.cave_version += 1
+
+    def cave(self, x, y):
+        # Returns the side table entry of the cave at the position or None
+        return self.caves.get((x, y))
+
+    def release_enemies(self):
+        # Return the enemies still alive in the caves to the pool once the maze is no longer played,
+        # enemies which died were returned when they were removed from their fight
+        for cave in self.caves.values():
+            EnemyLoader.release([enemy for enemy in cave.enemies if enemy.health > 0])
+            cave.release()
+
+
+class MazeLayer:
+    def __init__(self, maze, cell_size):
+        # Off-screen surface with the whole maze drawn on it, cells are only drawn again when their colour changes
+        self.maze = maze
+        self.cell_size = cell_size
+        self.surface = pygame.Surface((maze.width * cell_size, maze.height * cell_size))
+        # Surface with a pixel per node which full redraws are scaled up from
+        self.nodes = pygame.Surface((maze.width, maze.height), 0, self.surface)
+        self.redraw()
+
+    @staticmethod
+    def image(maze, surface):
+        # Colour of every node as a (width, height) array of pixels in the format of the surface,
+        # built by indexing the palette with the node types where hidden nodes use the first colour
+        palette = np.array([surface.map_rgb(colour) for colour in MazeNode.colours], dtype=np.uint32)
+        return palette[np.where(maze.visible, maze.types, 0)]
+
+    @staticmethod
+    def render(maze, cell_size):
+        # Returns a new surface of the maze, used for full redraws at any size such as a minimap
+        nodes = pygame.Surface((maze.width, maze.height))
+        pygame.surfarray.blit_array(nodes, MazeLayer.image(maze, nodes))
+        return pygame.transform.scale(nodes, (maze.width * cell_size, maze.height * cell_size))
+
+    def draw_cell(self, x, y):
+        rect = pygame.Rect(x * self.cell_size, y * self.cell_size, self.cell_size, self.cell_size)
+        pygame.draw.rect(self.surface, self.maze.colour(x, y), rect)
+
+    def redraw(self):
+        # Draw every node at once by copying the palette image to the node surface and scaling it up to cell_size
+        pygame.surfarray.blit_array(self.nodes, self.image(self.maze, self.nodes))
+        pygame.transform.scale(self.nodes, self.surface.get_size(), self.surface)
+        self.maze.dirty.clear()
+
+    def update(self):
+        # Draw the cells that changed since the last update and return the surface
+        for x, y in self.maze.dirty:
+            self.draw_cell(x, y)
+        self.maze.dirty.clear()
+        return self.surface
+
+
+class FogOfWar:
+    # Reveals the open cells within walking distance of a position. Only the (2 * radius + 1)^2 window around the
+    # position is touched, the scratch buffers are allocated once and cells are marked as queued by stamping them
+    # with the number of the reveal, so nothing has to be cleared between moves
+    def __init__(self, maze, radius):
+        self.maze = maze
+        self.radius = radius
+        self.size = 2 * radius + 1
+        self.generation = 0
+        self.stamps = [0] * self.size ** 2  # Reveal which last queued each cell of the window
+        self.queue = [0] * self.size ** 2  # Window indices of the queued cells
+        self.steps = [0] * self.size ** 2  # Walking distance of the queued cells
+        # Window offset and direction of the 4 neighbouring cells
+        self.neighbours = ((self.size, 1, 0), (-self.size, -1, 0), (1, 0, 1), (-1, 0, -1))
+
+    def reveal(self, x, y):
+        # Breadth first search from the position, returns the cells which became visible
+        self.generation += 1
+        generation, radius, size = self.generation, self.radius, self.size
+        stamps, queue, steps = self.stamps, self.queue, self.steps
+        types = self.maze.types
+        width, height = self.maze.width, self.maze.height
+        wall = MazeNodeType.WALL.value
+        reached = []
+        # The position is in the centre of the window, cells within the radius never leave it
+        centre = radius * size + radius
+        stamps[centre] = generation
+        queue[0], steps[0] = centre, 0
+        head, tail = 0, 1
+        while head < tail:
+            idx, dist = queue[head], steps[head]
+            head += 1
+            cx, cy = x + idx // size - radius, y + idx % size - radius
+            reached.append((cx, cy))
+            if dist == radius:
+                continue
+            for offset, dx, dy in self.neighbours:
+                nx, ny = cx + dx, cy + dy
+                if stamps[idx + offset] != generation and 0 <= nx < width and 0 <= ny < height and types[nx, ny] != wall:
+                    stamps[idx + offset] = generation
+                    queue[tail], steps[tail] = idx + offset, dist + 1
+                    tail += 1
+        return self.maze.reveal(reached)
+
+
+def find_dead_ends(grid):
+    # Open cells with a single open neighbour are dead ends, the start node never counts as one
+    open_cells = grid != MazeNodeType.WALL.value
+    return open_cells & (count_neighbours(open_cells) == 1) & (grid != MazeNodeType.START.value)
+
+
+def reachable(grid, x, y):
+    # Breadth first search over the open cells, returns a mask of the cells reachable from (x, y)
+    width, height = grid.shape
+    wall = MazeNodeType.WALL.value
+    seen = np.zeros(grid.shape, dtype=bool)
+    seen[x, y] = True
+    q = deque([(x, y)])
+    while q:
+        cx, cy = q.popleft()
+        for ex, ey in ((0, 1), (0, -1), (-1, 0), (1, 0)):
+            nx, ny = cx + ex, cy + ey
+            if 0 <= nx < width and 0 <= ny < height and grid[nx, ny] != wall and not seen[nx, ny]:
+                seen[nx, ny] = True
+                q.append((nx, ny))
+    return seen
+
+
+def is_tree(grid, start):
+    # A maze is a tree when every open cell can be reached from the start and there is one passage less than cells
+    open_cells = grid != MazeNodeType.WALL.value
+    passages = np.count_nonzero(open_cells[1:] & open_cells[:-1]) + np.count_nonzero(open_cells[:, 1:] & open_cells[:, :-1])
+    cells = np.count_nonzero(open_cells)
+    return passages == cells - 1 and np.count_nonzero(reachable(grid, *start)) == cells
+
+
+def smaller_half(grid, a, b, limit):
+    # Once a passage of a tree is walled up the cells a and b are in separate halves. Both halves are searched a
+    # cell at a time and the cells of the one which runs out first are returned, so only the smaller half is walked.
+    # Returns None if both halves have more than limit cells
+    width, height = grid.shape
+    wall = MazeNodeType.WALL.value
+    searches = [(deque([a]), {a}), (deque([b]), {b})]
+    while True:
+        for q, seen in searches:
+            if not q:
+                return seen
+            if len(seen) > limit:
+                return None
+            cx, cy = q.popleft()
+            for ex, ey in ((0, 1), (0, -1), (-1, 0), (1, 0)):
+                nx, ny = cx + ex, cy + ey
+                if 0 <= nx < width and 0 <= ny < height and grid[nx, ny] != wall and (nx, ny) not in seen:
+                    seen.add((nx, ny))
+                    q.append((nx, ny))
+
+
+def add_dead_ends(grid, start, needed, rng=random):
+    # Adds dead ends to a maze until it has the needed amount, without regenerating it.
+    # The passage next to a cell on a corridor is walled up, which turns the cell into a dead end, then both halves
+    # of the maze are joined again through a wall between 2 cells which are not dead ends.
+    # The maze stays connected and free of loops. Returns the number of passages moved
+    width, height = grid.shape
+    open_cells = grid != MazeNodeType.WALL.value
+    # Only passages are moved, so the open neighbours of a room are kept up to date by the moves instead of
+    # counted again over the whole grid
+    degree = count_neighbours(open_cells)
+    dead_ends = np.count_nonzero(find_dead_ends(grid))
+    # Cells the depth first search stepped on are at the same parity as the start
+    rooms = np.zeros(grid.shape, dtype=bool)
+    rooms[start[0] % 2::2, start[1] % 2::2] = True
+    rooms &= open_cells
+    candidates = []
+    listed = False  # Whether every candidate was listed again and none of them has worked since
+    # Most corridors split off a small part of the maze, the halves searched are kept small and only allowed to
+    # grow when no corridor splits within the limit
+    limit = 64
+    moved = 0
+    while dead_ends < needed:
+        gained = 0
+        while not gained and candidates:
+            x, y = candidates.pop()
+            if degree[x, y] == 2:
+                gained = split_corridor(grid, degree, rooms, x, y, limit)
+        if not gained:
+            if listed:
+                if limit >= grid.size:
+                    raise ValueError(f"A {width}x{height} maze cannot fit {needed} dead ends")
+                limit *= 4
+            # Corridors which did not split before may have changed since, so all of them are tried again
+            candidates = [(int(x), int(y)) for x, y in np.argwhere(rooms & (degree == 2)) if (x, y) != start]
+            rng.shuffle(candidates)
+            listed = True
+            continue
+        listed = False
+        dead_ends += gained
+        moved += 1
+    return moved
+
+
+def split_corridor(grid, degree, rooms, x, y, limit):
+    # Tries to turn the corridor cell (x, y) into a dead end, returns the number of dead ends gained, 0 if it failed.
+    # The open neighbours of the rooms in degree are updated with the passages moved. The corridor is only split
+    # where one of the halves has at most limit cells
+    width, height = grid.shape
+    wall = MazeNodeType.WALL.value
+    start = MazeNodeType.START.value
+    for dx, dy in ((0, 1), (0, -1), (-1, 0), (1, 0)):
+        bx, by = x + 2 * dx, y + 2 * dy
+        if not (0 <= bx < width and 0 <= by < height) or grid[x + dx, y + dy] == wall:
+            continue
+        # Wall up the passage and find the smaller of the 2 halves the maze is split into
+        grid[x + dx, y + dy] = wall
+        half = smaller_half(grid, (x, y), (bx, by), limit)
+        if half is None:
+            grid[x + dx, y + dy] = MazeNodeType.NORMAL.value
+            continue
+        # Join the halves through a wall between 2 cells that are not dead ends, so no dead end is lost. (x, y) is
+        # the new dead end and never joined. Only rooms are joined, a cell on a passage would open up a corner
+        for vx, vy in half:
+            if not rooms[vx, vy] or degree[vx, vy] < 2 or (vx, vy) == (x, y):
+                continue
+            for ex, ey in ((0, 1), (0, -1), (-1, 0), (1, 0)):
+                ux, uy = vx + 2 * ex, vy + 2 * ey
+                if not (0 <= ux < width and 0 <= uy < height) or (ux, uy) in half or (ux, uy) == (x, y):
+                    continue
+                if grid[ux, uy] != wall and degree[ux, uy] >= 2 and grid[vx + ex, vy + ey] == wall:
+                    cells = {(x, y), (bx, by), (vx, vy), (ux, uy)}
+                    before = sum(degree[c] == 1 and grid[c] != start for c in cells)
+                    grid[vx + ex, vy + ey] = MazeNodeType.NORMAL.value
+                    degree[x, y] -= 1
+                    degree[bx, by] -= 1
+                    degree[vx, vy] += 1
+                    degree[ux, uy] += 1
+                    return sum(degree[c] == 1 and grid[c] != start for c in cells) - before
+        grid[x + dx, y + dy] = MazeNodeType.NORMAL.value
+    return 0
 
 
 class MazeGen:
     def __init__(self, width, height, start, setting,game):
-        self.visited = None
         self.maze = None
         self.caves = None
+        self.repairs = 0  # Number of passages moved to create enough dead ends
+        self.generation_time = 0  # Seconds taken to generate the maze
         self.setting = setting
         self.startX, self.startY = start
         self.height = height
@@ -79,63 +418,40 @@ class MazeGen:
         self.start = start
         self.end = start
         self.enemyLoader = EnemyLoader(setting["enemies"],game)
+        # Algorithm used to carve the maze, chosen per difficulty in the settings
+        self.algorithm = ALGORITHMS[setting.get("algorithm", "dfs")](streams.maze)
         self.generate_maze()
 
     def generate_maze(self):
-        # The maze initially would be a grid of walls with the start node being the only normal node
-        self.maze = np.full((self.width, self.height), MazeNode(MazeNodeType.WALL))
-        self.visited = np.zeros((self.width, self.height), dtype=bool)
-        # dfs function will turn the walls into normal nodes to generate the maze
-        self.dfs(self.startX, self.startY, 0)
-        self.maze[self.startX][self.startY] = MazeNode(MazeNodeType.START)
+        start_time = time.perf_counter()
+        # Carve the maze into a compact integer grid of walls and normal nodes which backs the maze arrays
+        grid = self.algorithm.carve(self.width, self.height, self.start)
+        grid[self.startX, self.startY] = MazeNodeType.START.value
+        # Move passages around until there are enough dead ends for the caves instead of generating a new maze
+        self.repairs = add_dead_ends(grid, self.start, self.setting["caves"]["min"], streams.maze)
+        # Mark the dead ends from the neighbour counts of the final maze
+        grid[find_dead_ends(grid)] = MazeNodeType.DEAD_END.value
+        self.maze = Maze(grid)
         self.assign_cave()
+        self.generation_time = time.perf_counter() - start_time
 
     def assign_cave(self):
-        self.caves = []
         # Assigns caves to dead ends based on the settings
         nums = list(self.setting["caves"].values())[1::]
         for i in range(len(nums)):
             # If number is a float, randomly round up or down based on the decimal value
-            nums[i] = ((nums[i] - int(nums[i])) > random.random()) + int(nums[i])
-        for i in range(self.width):
-            for j in range(self.height):
-                # If the node is a dead end, assign a cave to it
-                if self.maze[i][j].type == MazeNodeType.DEAD_END:
-                    self.maze[i][j].cave_type = CaveType.REWARD
-                    self.caves.append((i, j))
-        # If there are not enough caves, regenerate the maze
-        if len(self.caves) < self.setting["caves"]["min"]:
-            self.generate_maze()
-            return
-        # Shuffle the caves and assign them to the nodes
-        random.shuffle(self.caves)
-        idx = 0
+            nums[i] = ((nums[i] - int(nums[i])) > streams.maze.random()) + int(nums[i])
+        # Shuffle the dead ends, the first one and any left over after the settings are used up are reward caves
+        self.caves = [(int(x), int(y)) for x, y in np.argwhere(self.maze.types == MazeNodeType.DEAD_END.value)]
+        streams.maze.shuffle(self.caves)
+        cave_types = [CaveType.REWARD]
         for i in range(len(nums)):
-            for j in range(nums[i]):
-                idx += 1
-                x, y = self.caves[idx]
-                self.maze[x][y].cave_type = CaveType(i)
+            cave_types += [CaveType(i)] * nums[i]
+        cave_types += [CaveType.REWARD] * (len(self.caves) - len(cave_types))
+        self.maze.add_caves(self.caves, cave_types[:len(self.caves)])
         # Setup the caves
         for x, y in self.caves:
-            self.maze[x][y].setup_cave(self.enemyLoader, self.setting["caves setup"])
+            self.maze.cave(x, y).setup_cave(self.setting["caves setup"], streams.maze)
 
     def getMaze(self):
         return self.maze
-
-    def dfs(self, x, y, dis):
-        # Randomised depth first search algorithm to generate a maze
-        self.visited[x][y] = True
-        self.maze[x][y] = MazeNode(MazeNodeType.NORMAL)
-        directions = [(0, 1), (0, -1), (-1, 0), (1, 0)]
-        random.shuffle(directions)
-        count = 0
-        for dx, dy in directions:
-            nx, ny = x + 2 * dx, y + 2 * dy
-            if not (0 <= nx < self.width and 0 <= ny < self.height) or self.visited[nx][ny]:
-                continue
-            count += 1
-            self.maze[x + dx][y + dy] = MazeNode(MazeNodeType.NORMAL)
-            # Recursively call the function with the new coordinates
-            self.dfs(nx, ny, dis + 2)
-        if count == 0:
-            self.maze[x][y] = MazeNode(MazeNodeType.DEAD_END)
@@ -0,0 +1,29 @@
+import random
+
+
+class RandomStreams:
+    # Separate random generators for each part of the game, all seeded from one master seed so a game can be
+    # played again exactly. Numbers drawn from one stream never change what another stream draws, so the jitter of
+    # a damage number cannot change the outcome of a fight
+    #   maze       the layout, the caves, their enemies, the start position and bat teleports
+    #   loot       weapons picked from the loader and their rolled stats
+    #   combat     enemy actions, crits and targets
+    #   cosmetics  anything which is only drawn, like damage numbers
+    names = ("maze", "loot", "combat", "cosmetics")
+
+    def __init__(self, seed=None):
+        self.seed = None
+        self.reseed(seed)
+
+    def reseed(self, seed=None):
+        # Starts every stream again from the master seed, a random master seed is picked if none is given
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        self.seed = seed
+        master = random.Random(seed)
+        for name in self.names:
+            setattr(self, name, random.Random(master.getrandbits(64)))
+
+
+# Streams used by the game, reseeded when a game starts
+streams = RandomStreams()
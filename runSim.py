@@ -0,0 +1,199 @@
+import os
+# Runs are played without a window, the drivers have to be chosen before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+import json
+import multiprocessing
+import sys
+import time
+from mazeGen import *
+from combatEngine import CombatEngine
+
+# Same maze size as Game
+WIDTH = 25
+HEIGHT = 15
+# Settings of every difficulty and the weapons, loaded once in each worker
+settings = None
+weaponLoader = None
+
+
+class RunSim:
+    # Plays a whole run of one difficulty without a display, using MazeGen, the loaders and the combat engine.
+    # The player is a bot which has seen the whole maze but does not know what is in the caves. It walks to the
+    # nearest cave it has not been in, equips the weapon with the most expected damage and spends its coins in shops
+    def __init__(self, setting, weaponLoader):
+        self.setting = setting
+        self.weaponLoader = weaponLoader  # Weapons are made from the archetypes of the loader, so loaders can be shared
+        self.player = None
+        self.inventory = []
+        self.gen = None
+        self.maze = None
+        self.visited = set()  # Caves the bot has been in
+        self.shops = set()
+        self.result = None  # "cleared", "died", "hole" or "stuck" once the run is over
+        self.steps = 0
+        self.fights = 0
+        self.turns = 0
+        self.teleports = 0
+
+    def run(self):
+        # Same set up as Game.setup
+        start = (streams.maze.randint(0, WIDTH // 2) * 2, streams.maze.randint(0, HEIGHT // 2) * 2)
+        self.player = Player(*start, self.setting["player"])
+        self.inventory = [Weapon(self.weaponLoader.weapons[0])]
+        self.equip()
+        self.gen = MazeGen(WIDTH, HEIGHT, start, self.setting, self)
+        self.maze = self.gen.getMaze()
+        self.maze.visible[:] = True
+        while self.result is None:
+            target = self.next_cave()
+            if target is None:
+                self.result = "stuck"
+                break
+            self.player.x, self.player.y = target
+            self.node_effect()
+        self.maze.release_enemies()
+        return {"result": self.result, "steps": self.steps, "fights": self.fights, "turns": self.turns,
+                "caves": len(self.visited), "teleports": self.teleports}
+
+    def next_cave(self):
+        # Goes back to a shop when low on health, otherwise to the nearest cave which has not been visited
+        distances = self.maze.distances_to(self.player.x, self.player.y)
+        targets = [cave for cave in self.gen.caves if cave not in self.visited]
+        if self.shops and self.player.coins >= 10 and self.player.health < self.player.maxHealth * 0.5:
+            targets = list(self.shops)
+        targets = [cave for cave in targets if distances[cave] > 0]
+        if not targets:
+            return None
+        target = min(targets, key=lambda cave: distances[cave])
+        self.steps += int(distances[target])
+        return target
+
+    def node_effect(self):
+        # Same effects as Game.node_effect
+        pos = (self.player.x, self.player.y)
+        node = self.maze.cave(*pos)
+        if node is None:
+            return
+        self.visited.add(pos)
+        if node.cave_type in (CaveType.BOSS, CaveType.ORC):
+            self.fight(node)
+        elif node.cave_type == CaveType.BAT:
+            # Teleport to a random cave, which could be another bat or a hole
+            self.teleports += 1
+            self.player.x, self.player.y = self.gen.caves[streams.maze.randint(0, len(self.gen.caves) - 1)]
+            self.node_effect()
+        elif node.cave_type == CaveType.SHOP:
+            self.shops.add(pos)
+            self.shop()
+        elif node.cave_type == CaveType.HOLE:
+            self.result = "hole"
+        elif node.cave_type == CaveType.REWARD:
+            self.add_random_weapon([2, 3])
+            self.player.maxHealth += 50
+            self.player.health += 50
+            node.cave_type = CaveType.BLANK
+
+    def fight(self, cave):
+        # Plays the fight through the combat engine, attacking the enemy with the least health
+        enemies = cave.populate(self.gen.enemyLoader)
+        engine = CombatEngine(self.player, enemies, streams.combat)
+        result = engine.resolve(lambda engine: min(engine.enemies, key=lambda enemy: enemy.health))
+        self.fights += 1
+        self.turns += engine.turns
+        self.player.affected_dot = []
+        cave.enemies = engine.enemies
+        EnemyLoader.release([enemy for enemy in enemies if enemy.health <= 0])
+        if result == "defeat":
+            self.result = "died"
+            return
+        if cave.cave_type == CaveType.BOSS:
+            self.result = "cleared"
+        self.player.coins += cave.reward
+        cave.reward = 0
+        cave.cave_type = CaveType.BLANK
+        cave.release()
+
+    def shop(self):
+        # Heal while below 70% health, then buy weapons and spend what is left on health buffs
+        while self.player.coins >= 10 and self.player.health < self.player.maxHealth * 0.7:
+            self.player.coins -= 10
+            self.player.health = min(self.player.health + self.player.maxHealth * 0.3, self.player.maxHealth)
+        while self.player.coins >= 15 and len(self.inventory) < 20:
+            self.player.coins -= 15
+            self.add_random_weapon([1, 2])
+        while self.player.coins >= 10:
+            self.player.coins -= 10
+            self.player.maxHealth += 50
+            self.player.health += 50
+
+    def add_random_weapon(self, rarities):
+        # Same as Game.add_random_weapon, then equips the best weapon
+        if len(self.inventory) >= 20:
+            return
+        weapon = Weapon(self.weaponLoader.get_random(rarities))
+        weapon.roll()
+        self.inventory.append(weapon)
+        self.equip()
+
+    def equip(self):
+        # Rough damage of a hit including crits, damage over time and splash onto one other enemy
+        def expected(weapon):
+            hit = weapon.damage * (1 + weapon.critRate * (weapon.critDamage - 1))
+            splash = weapon.splashDam * (weapon.splashRange > 0)
+            return hit * (1 + splash) + weapon.damage * weapon.DOTDam * weapon.DOTTurns
+        self.player.weapon = max(self.inventory, key=expected)
+        self.player.damage = self.player.weapon.damage
+
+
+def init_worker():
+    # Every worker needs pygame for the images and fonts the loaders create and its own copy of the settings
+    global settings, weaponLoader
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    with open(Path(__file__).resolve().with_name("settings.json"), mode="r", encoding="utf-8") as read_file:
+        settings = json.load(read_file)
+    weaponLoader = WeaponLoader()
+
+
+def play(task):
+    # Plays one run, every run has its own seed so the results do not depend on the number of workers
+    difficulty, seed = task
+    streams.reseed(seed)
+    return difficulty, RunSim(settings[difficulty], weaponLoader).run()
+
+
+def main():
+    # Prints the outcome of many runs of every difficulty,
+    # pass the number of runs per difficulty and the number of worker processes on the command line
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    with open(Path(__file__).resolve().with_name("settings.json"), mode="r", encoding="utf-8") as read_file:
+        difficulties = list(json.load(read_file))
+    tasks = [(difficulty, i * len(difficulties) + j) for j, difficulty in enumerate(difficulties) for i in range(runs)]
+    results = {difficulty: [] for difficulty in difficulties}
+    start_time = time.perf_counter()
+    # Workers are spawned instead of forked so each one starts pygame from scratch, which is also how Windows starts them
+    with multiprocessing.get_context("spawn").Pool(processes, initializer=init_worker) as pool:
+        for difficulty, result in pool.imap_unordered(play, tasks, chunksize=max(1, len(tasks) // (processes * 8))):
+            results[difficulty].append(result)
+        # Let the workers exit on their own, terminating them can hang while one of them waits for a task
+        pool.close()
+        pool.join()
+    elapsed = time.perf_counter() - start_time
+    print(f"{'difficulty':<12}{'cleared':>9}{'died':>7}{'hole':>7}{'stuck':>7}"
+          f"{'steps':>8}{'fights':>8}{'turns':>8}{'caves':>7}{'bats':>6}")
+    for difficulty, done in results.items():
+        def rate(result):
+            return sum(run["result"] == result for run in done) / len(done)
+
+        def mean(key):
+            return sum(run[key] for run in done) / len(done)
+        print(f"{difficulty:<12}{rate('cleared'):>9.1%}{rate('died'):>7.1%}{rate('hole'):>7.1%}{rate('stuck'):>7.1%}"
+              f"{mean('steps'):>8.1f}{mean('fights'):>8.1f}{mean('turns'):>8.1f}{mean('caves'):>7.1f}"
+              f"{mean('teleports'):>6.2f}")
+    print(f"{len(tasks)} runs in {elapsed:.2f}s with {processes} processes, {len(tasks) / elapsed:.1f} runs per second")
+
+
+if __name__ == "__main__":
+    main()
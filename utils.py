@@ -1,14 +1,65 @@
+import bisect
 import enum
-import random
+import itertools
 import pygame
 import csv
+from collections import OrderedDict
 from pathlib import Path
+from combatEngine import *
+from randomStreams import *
+
+
+class Fonts:
+    # Registry of fonts keyed by (face, size, bold) and a bounded cache of rendered text surfaces keyed by
+    # (string, font, colour). SysFont scans the system fonts, so each font is only created once
+    fonts = {}
+    texts = OrderedDict()
+    max_texts = 512
+    font_hits = 0
+    font_misses = 0
+    text_hits = 0
+    text_misses = 0
+
+    @classmethod
+    def get(cls, face, size, bold=False):
+        # Returns the shared font, fonts are shared so they must not be changed with set_bold or similar
+        key = (face, size, bold)
+        if key in cls.fonts:
+            cls.font_hits += 1
+        else:
+            cls.font_misses += 1
+            cls.fonts[key] = pygame.font.SysFont(face, size, bold)
+        return cls.fonts[key]
+
+    @classmethod
+    def render(cls, string, font, colour):
+        # Returns the rendered text, surfaces are shared so copy them before changing them
+        key = (string, font, colour)
+        if key in cls.texts:
+            cls.text_hits += 1
+            cls.texts.move_to_end(key)
+        else:
+            cls.text_misses += 1
+            cls.texts[key] = font.render(string, True, colour)
+            # Drop the least recently used text once the cache is full
+            if len(cls.texts) > cls.max_texts:
+                cls.texts.popitem(last=False)
+        return cls.texts[key]
+
+    @classmethod
+    def stats(cls):
+        return {"font hits": cls.font_hits, "font misses": cls.font_misses,
+                "text hits": cls.text_hits, "text misses": cls.text_misses, "texts cached": len(cls.texts)}
 
 
 class WeaponLoader:
+    archetypes = []  # Weapons loaded from the csv files, shared by every loader so the icons are only loaded once
+    tables = {}  # Weapons and running totals of their rarities for every set of rarities, built with the archetypes
+
     def __init__(self):
-        self.weapons = []
-        self.setup()
+        if not WeaponLoader.archetypes:
+            self.setup()
+        self.weapons = WeaponLoader.archetypes
 
     def setup(self):
         # Load weapons from csv files
@@ -17,24 +68,35 @@ class WeaponLoader:
                 reader = csv.reader(file)
                 next(reader)  # Skip the heading
                 for row in reader:
-                    self.weapons.append(Weapon(*row, getattr(WeaponType, weapon_type.upper())))
+                    WeaponLoader.archetypes.append(WeaponArchetype(*row, getattr(WeaponType, weapon_type.upper())))
+        # Build the loot table of every set of rarities the weapons have
+        rarities = sorted({weapon.rarity for weapon in WeaponLoader.archetypes})
+        for size in range(1, len(rarities) + 1):
+            for key in itertools.combinations(rarities, size):
+                weapons = [weapon for weapon in WeaponLoader.archetypes if weapon.rarity in key]
+                WeaponLoader.tables[key] = (weapons, list(itertools.accumulate(weapon.rarity for weapon in weapons)))
+
+    def table(self, rarities):
+        # Weapons of the rarities and the running totals of their rarities, rarities no weapon has are left out
+        return WeaponLoader.tables[tuple(sorted(r for r in set(rarities) if (r,) in WeaponLoader.tables))]
 
     def get_random(self, rarities):
         # Get a random weapon based on the rarity
         # Imagine each weapon as a segment with width rarity as length on a line.
         # Random number is picked between 1 and total rarity of weapons will point to a weapon which would be returned
-        total_rarity = sum(weapon.rarity for weapon in self.weapons if weapon.rarity in rarities)
-        pick = random.randint(1, total_rarity)
-        current = 0
-        for weapon in self.weapons:
-            if weapon.rarity not in rarities:
-                continue
-            current += weapon.rarity
-            if current >= pick:
-                return weapon
+        weapons, totals = self.table(rarities)
+        return weapons[bisect.bisect_left(totals, streams.loot.randint(1, totals[-1]))]
 
+    def get_randoms(self, rarities, k):
+        # Get k random weapons at once, drawn the same way as k calls of get_random
+        weapons, totals = self.table(rarities)
+        randint = streams.loot.randint
+        return [weapons[bisect.bisect_left(totals, randint(1, totals[-1]))] for _ in range(k)]
 
-class Weapon:
+
+class WeaponArchetype:
+    # Stats, icon and colour of a weapon as loaded from the csv files, shared by every weapon made from it and never
+    # changed after loading
     def __init__(self, name, damage, crit_rate, crit_damage, DOTTurns, DOTDam, splashRange, splashDam, rarity, iconPath,
                  weaponType):
         self.name = name
@@ -50,13 +112,43 @@ class Weapon:
         self.iconPath = Path(__file__).resolve().parent / iconPath
         self.icon = pygame.image.load(self.iconPath).convert_alpha()
         self.background_colour = {1: (255, 215, 0), 2: (200, 145, 255), 3: (96, 222, 247)}.get(self.rarity)
-        self.stats_surface = self.update_stats()
+
+
+class Weapon:
+    # A weapon in the inventory, only the stats which can be rolled are stored, everything else is read from the
+    # archetype it was made from
+    __slots__ = ("base", "damage", "critRate", "critDamage", "DOTDam", "splashDam", "_stats_surface")
+
+    def __init__(self, base):
+        self.base = base
+        self.damage = base.damage
+        self.critRate = base.critRate
+        self.critDamage = base.critDamage
+        self.DOTDam = base.DOTDam
+        self.splashDam = base.splashDam
+        self._stats_surface = None
+
+    name = property(lambda self: self.base.name)
+    DOTTurns = property(lambda self: self.base.DOTTurns)
+    splashRange = property(lambda self: self.base.splashRange)
+    rarity = property(lambda self: self.base.rarity)
+    weaponType = property(lambda self: self.base.weaponType)
+    iconPath = property(lambda self: self.base.iconPath)
+    icon = property(lambda self: self.base.icon)
+    background_colour = property(lambda self: self.base.background_colour)
+
+    @property
+    def stats_surface(self):
+        # The stats are only rendered the first time they are displayed
+        if self._stats_surface is None:
+            self._stats_surface = self.update_stats()
+        return self._stats_surface
 
     def roll(self):
         # Randomly change the stats of the weapon
         for attr in ['damage', 'critRate', 'critDamage', 'DOTDam', 'splashDam']:
-            setattr(self, attr, round(getattr(self, attr) * random.uniform(0.75, 1.25), 2))
-        self.stats_surface = self.update_stats()
+            setattr(self, attr, round(getattr(self, attr) * streams.loot.uniform(0.75, 1.25), 2))
+        self._stats_surface = None
 
     def info(self):
         # Returns the stats of the weapon
@@ -81,7 +173,7 @@ class Weapon:
         width = 0
         # Calculate the size of the surface such that it can fit all the strings
         for string, font_size in self.info():
-            font = pygame.font.SysFont("Arial", font_size)
+            font = Fonts.get("Arial", font_size)
             total_height += font.get_linesize()
             width = max(width, font.size(string)[0])
         surface = pygame.Surface((width, total_height))
@@ -92,8 +184,8 @@ class Weapon:
         y_offset = text_y
         # Render the strings on the surface
         for string, font_size in self.info():
-            font = pygame.font.SysFont("Arial", font_size)
-            text_surface = font.render(string, True, text_color)
+            font = Fonts.get("Arial", font_size)
+            text_surface = Fonts.render(string, font, text_color)
             text_rect = text_surface.get_rect(x=text_x, y=y_offset)
             surface.blit(text_surface, text_rect)
             y_offset += font.get_linesize()
@@ -101,6 +193,8 @@ class Weapon:
 
 
 class Button:
+    delete_icon = None  # Scaled delete.png drawn on weapon buttons, loaded by the first one
+
     def __init__(self, x, y, w, h, data, callback, toggle, background=None, info=None):
         self.x = x  # X position
         self.y = y  # Y position
@@ -110,7 +204,7 @@ class Button:
         self.callback = callback  # Function called when the button is pressed
         self.toggle = toggle  # Function called when the button is toggled
         self.info = info  # Additional information associated with the button
-        self.font = pygame.font.SysFont("Arial", round(h * 0.75))  # Font for the button text
+        self.font = Fonts.get("Arial", round(h * 0.75))  # Font for the button text
         self.toggled = False
         self.selected = False
         button_rect = pygame.Rect(self.x, self.y, self.w, self.h)  # Rectangle defining the button's area
@@ -128,15 +222,16 @@ class Button:
             if background is not None:
                 self.surface.fill(background)  # Fill the background if specified
             # Render the text and blit it onto the button's surface
-            text_rect = self.font.render(self.data, True, (255, 255, 255))
+            text_rect = Fonts.render(self.data, self.font, (255, 255, 255))
             self.surface.blit(text_rect, (self.surface.get_width() // 2 - text_rect.get_width() // 2,
                                           self.surface.get_height() // 2 - text_rect.get_height() // 2))
             self.rect = self.surface.get_rect(center=button_rect.center)  # Get the rect for positioning
         # If info is a Weapon, display an additional icon on the button
         if isinstance(info, Weapon):
-            img = pygame.image.load(Path(__file__).resolve().with_name("delete.png")).convert_alpha()
-            img = pygame.transform.scale(img, (8, 8))
-            self.surface.blit(img, (0, 0))
+            if Button.delete_icon is None:
+                img = pygame.image.load(Path(__file__).resolve().with_name("delete.png")).convert_alpha()
+                Button.delete_icon = pygame.transform.scale(img, (8, 8))
+            self.surface.blit(Button.delete_icon, (0, 0))
         self.top_rect = pygame.Rect(self.x, self.y, self.w, 1)
         self.bottom_rect = pygame.Rect(self.x, self.y + self.h, self.w, 1)
 
@@ -147,31 +242,163 @@ class Button:
         self.rect = self.surface.get_rect(center=button_rect.center)
 
 
+class ButtonRegistry(dict):
+    # Groups of buttons keyed by name. Each group is a layer and layers are drawn in the order they were added, so
+    # later layers are on top. A uniform grid over the screen lists the buttons over each cell so only the buttons
+    # near the mouse are tested. The hovered button is remembered so hover only changes when the mouse enters or
+    # leaves a button. Groups which are assigned are picked up automatically, call changed after changing a group in
+    # place or moving its buttons
+    def __init__(self, cell_size=64):
+        super().__init__()
+        self.cell_size = cell_size
+        self.grid = {}  # (column, row) -> [(layer, button)]
+        self.dirty = True  # Whether the grid has to be built again
+        self.hovered = None
+        self.mouse = None  # Last position passed to hover
+        self.version = 0  # Increases whenever the buttons change
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.changed()
+
+    def changed(self):
+        self.dirty = True
+        self.version += 1
+
+    def build(self):
+        # Add every button to the cells its rect covers
+        self.grid = {}
+        size = self.cell_size
+        for layer, arr in enumerate(self.values()):
+            for button in arr:
+                for column in range(int(button.x) // size, int(button.x + button.w) // size + 1):
+                    for row in range(int(button.y) // size, int(button.y + button.h) // size + 1):
+                        self.grid.setdefault((column, row), []).append((layer, button))
+        self.dirty = False
+        # Buttons may have appeared, moved or gone from under the mouse
+        if self.mouse is not None:
+            self.hover(*self.mouse)
+
+    def at(self, x, y):
+        # Returns the top button at the position or None
+        if self.dirty:
+            self.build()
+        top = None
+        top_layer = -1
+        for layer, button in self.grid.get((int(x) // self.cell_size, int(y) // self.cell_size), ()):
+            if layer >= top_layer and button.x < x < button.x + button.w and button.y < y < button.y + button.h:
+                top, top_layer = button, layer
+        return top
+
+    def hover(self, x, y):
+        # Moves the hover to the button at the position, only the buttons entering and leaving hover change
+        self.mouse = (x, y)
+        button = self.at(x, y)
+        if button is not self.hovered:
+            if self.hovered is not None:
+                self.hovered.toggled = False
+            if button is not None:
+                button.toggled = True
+            self.hovered = button
+
+    def toggle_hovered(self):
+        # Calls the toggle function of the hovered button, which draws its hover effect for this frame
+        if self.dirty:
+            self.build()
+        if self.hovered is not None and self.hovered.toggle:
+            self.hovered.toggle(self.hovered)
+
+
+class Compositor:
+    # Presents only the parts of the screen which changed. Everything is still drawn to the screen surface every
+    # frame, the parts which changed are marked while drawing and only those are pushed to the display. The marks of
+    # the previous frame are pushed again so anything which is no longer drawn is cleared from the display.
+    # A new scene, such as entering combat or a shop, pushes the whole screen
+    def __init__(self, screen):
+        self.screen = screen
+        self.rects = []  # Parts marked this frame
+        self.last = []  # Parts marked last frame
+        self.scene = None
+        self.pixels = 0  # Pixels pushed to the display by the last frame
+        self.total_pixels = 0
+        self.frames = 0
+
+    def mark(self, rect):
+        if rect:
+            self.rects.append(pygame.Rect(rect))
+
+    def present(self, scene):
+        # Push the marked parts to the display, or the whole screen if the scene changed
+        screen_rect = self.screen.get_rect()
+        if scene != self.scene:
+            self.scene = scene
+            pygame.display.flip()
+            self.pixels = screen_rect.width * screen_rect.height
+        else:
+            # The same part is often marked in both frames, it only has to be pushed once
+            rects = {tuple(rect.clip(screen_rect)) for rect in self.rects + self.last}
+            rects = [pygame.Rect(rect) for rect in rects if rect[2] and rect[3]]
+            pygame.display.update(rects)
+            self.pixels = sum(rect.width * rect.height for rect in rects)
+        self.last, self.rects = self.rects, []
+        self.total_pixels += self.pixels
+        self.frames += 1
+
+    def average_pixels(self):
+        # Mean pixels pushed per frame
+        return self.total_pixels / self.frames if self.frames else 0
+
+
 class Alert:
     def __init__(self, game):
         self.game = game  # Reference to the game object
         self.text = ""  # Current text to display
         self.txtArr = [[game.get_info, float("inf")]]  # Array of texts with their display durations
-        self.font = pygame.font.SysFont("Arial", int(self.game.cell_size * 0.75))  # Font for the alert text
-        self.text_surface = self.font.render(self.text, True, (255, 0, 0))  # Surface for rendering the text
+        self.font = Fonts.get("Arial", int(self.game.cell_size * 0.75))  # Font for the alert text
+        self.text_surface = Fonts.render(self.text, self.font, (255, 0, 0))  # Surface for rendering the text
+        self.rect = None  # Where the text was last drawn
 
     def change_text(self):
         # Update the text based on the first item in txtArr
         # If the first item is callable, call it to get the text; otherwise, use it directly
-        self.text = self.txtArr[0][0]() + " " if callable(self.txtArr[0][0]) else str(self.txtArr[0][0]) + " "
-        self.text_surface = self.font.render(self.text, True, (255, 0, 0))  # Update the text surface with the new text
+        text = self.txtArr[0][0]() + " " if callable(self.txtArr[0][0]) else str(self.txtArr[0][0]) + " "
+        # Only render the text again when it changed, returns whether it did
+        if text == self.text:
+            return False
+        self.text = text
+        self.text_surface = Fonts.render(self.text, self.font, (255, 0, 0))
+        return True
+
+    def idle_time(self):
+        # Seconds which can pass before the text shown changes
+        return self.txtArr[0][1]
 
     def add_text(self, data, time):
-        # Add a new text with its display duration to txtArr
-        self.txtArr.insert(0, [data, time * 60])  # Convert time from seconds to frames (assuming 60 fps)
+        # Add a new text with its display duration in seconds to txtArr
+        self.txtArr.insert(0, [data, time])
+
+    def update(self, dt):
+        # Count down the texts by the seconds passed and remove the ones whose duration has expired
+        for entry in self.txtArr:
+            entry[1] -= dt
+        if self.txtArr[0][1] <= 1e-9:
+            self.txtArr = [entry for entry in self.txtArr if entry[1] > 1e-9]
 
     def render(self):
         # Render the current text on the game screen
-        # Update txtArr to remove texts whose duration has expired
-        self.txtArr = [[text, time - 1] for text, time in self.txtArr if time > 1]
-        self.change_text()  # Update the text to the next one if the current has expired
+        changed = self.change_text()  # Update the text to the next one if the current has expired
         # Blit the text surface to the game screen, positioned at the top right
-        self.game.screen.blit(self.text_surface, (self.game.screen.get_width() - self.text_surface.get_width(), 0))
+        rect = self.game.screen.blit(self.text_surface,
+                                     (self.game.screen.get_width() - self.text_surface.get_width(), 0))
+        # The old text has to be cleared from the display as well as the new one shown
+        if changed:
+            self.game.compositor.mark(self.rect)
+            self.game.compositor.mark(rect)
+        self.rect = rect
 
 
 class Direction(enum.Enum):
@@ -191,8 +418,3 @@ class Direction(enum.Enum):
         if self == Direction.RIGHT:
             return Direction.LEFT
 
-
-class WeaponType(enum.Enum):
-    SWORDS = 0
-    BOWS = 1
-    WANDS = 2